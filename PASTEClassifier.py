@@ -31,8 +31,26 @@
 # knowledge of the CeCILL license and that you accept its terms.
 
 import os
+import re
 import sys
+import copy
+import glob
+import json
+import math
+import time
+import fcntl
 import shutil
+import signal
+import string
+import resource
+import sqlite3
+import Queue
+import socket
+import hashlib
+import threading
+import SocketServer
+import subprocess
+import multiprocessing
 
 sys.path.append(os.environ["REPET_PATH"])
 if not "REPET_PATH" in os.environ.keys():
@@ -50,8 +68,6 @@ from commons.core.utils.RepetOptionParser import RepetOptionParser
 from commons.core.checker.CheckerUtils import CheckerUtils
 from commons.core.checker.ConfigChecker import ConfigRules
 from commons.core.checker.ConfigChecker import ConfigChecker
-from commons.core.checker.CheckerException import CheckerException
-from commons.core.seq.FastaUtils import FastaUtils
 from commons.core.sql.DbFactory import DbFactory
 from commons.core.sql.TableJobAdaptatorFactory import TableJobAdaptatorFactory
 from commons.core.launcher.Launcher import Launcher
@@ -67,6 +83,942 @@ from PASTEC.StatPastec import StatPastec
 
 LOG_DEPTH = "repet.tools"
 
+# Fixed cost of a sequence in a batch, in base pair equivalent (tools startup, rules, parsing)
+SEQ_COST_OVERHEAD = 500
+
+# Options of [detect_features] read by DetectTEFeatures
+DETECT_FEATURES_OPTIONS = ["term_rep", "polyA", "tand_rep", "orf", "blast", "TE_BLRn", "TE_BLRtx", "TE_nucl_bank", "TE_BLRx", "TE_prot_bank", "HG_BLRn", "HG_nucl_bank", "TE_HMMER", "TE_HMM_profiles", "TE_HMMER_evalue", "rDNA_BLRn", "rDNA_bank", "tRNA_scan", "TRFmaxPeriod"]
+
+# Tables written by DetectTEFeatures for each option of [detect_features] set to 'yes'. A table missing from the
+# database makes a resumed run compute STEP 1 again.
+DETECT_FEATURES_TABLES = {"term_rep": "TR_set", "polyA": "polyA_set", "tand_rep": "SSR_set", "orf": "ORF_map", "TE_BLRn": "TE_BLRn_path", "TE_BLRtx": "TE_BLRtx_path", "TE_BLRx": "TE_BLRx_path", "HG_BLRn": "HG_BLRn_path", "rDNA_BLRn": "rDNA_BLRn_path", "TE_HMMER": "TE_HMMER_path", "tRNA_scan": "tRNA_set"}
+
+# Banks of [detect_features] and their type
+DETECT_FEATURES_BANKS = {"TE_nucl_bank": "nucl", "TE_prot_bank": "prot", "HG_nucl_bank": "nucl", "rDNA_bank": "nucl", "TE_HMM_profiles": "hmm"}
+
+# Tables of the sequence banks of [detect_features] loaded in the database by LaunchPASTEC STEP 1. A table missing from
+# the database makes STEP 1 load the banks again.
+PASTEC_BANK_TABLES = {"TE_nucl_bank": "TE_nucl_bank_seq", "TE_prot_bank": "TE_prot_bank_seq", "HG_nucl_bank": "HG_nucl_bank_seq", "rDNA_bank": "rDNA_bank_seq"}
+
+# Complement of the nucleotides and IUPAC codes
+COMPLEMENT = string.maketrans("ACGTRYKMBDHVNacgtrykmbdhvn", "TGCAYRMKVHDBNtgcayrmkvhdbn")
+
+# Number of batches per local process with dynamic batches
+DYNAMIC_BATCHES_PER_PROCESS = 4
+
+# Options of [classif_consensus] read by LaunchPASTEC STEP 2 to build a classif line, the others only drive the run and
+# the post processing
+CLASSIF_CONSENSUS_OPTIONS = ["max_profiles_evalue", "min_TE_profiles_coverage", "min_HG_profiles_coverage", "max_helitron_extremities_evalue", "min_TE_bank_coverage", "min_HG_bank_coverage", "min_rDNA_bank_coverage", "min_HG_bank_identity", "min_rDNA_bank_identity", "min_SSR_coverage", "max_SSR_size"]
+
+####FastaIndex
+#
+# Index of a fasta file built in one pass: header, byte offset, byte size, sequence length and header validity
+# of each record. It is saved in a sidecar file and reused as long as the fasta file size and date are unchanged.
+#
+class FastaIndex(object):
+
+    # same authorized characters as CheckerUtils.checkHeaders
+    WRONG_HEADER_CHARS = re.compile("[^a-zA-Z0-9_:\.\-]")
+
+    def __init__(self, fastaFileName, indexFileName = ""):
+        self._fastaFileName = fastaFileName
+        self._indexFileName = indexFileName
+        if self._indexFileName == "":
+            self._indexFileName = "%s.pcidx" % fastaFileName
+        self._lRecords = []
+
+    def _getSignature(self):
+        stat = os.stat(self._fastaFileName)
+        return "#%i\t%i\t%r" % (stat.st_ino, stat.st_size, stat.st_mtime)
+
+    # # Load the sidecar index if it is up to date, build it (and try to save it) otherwise.
+    #
+    # @return boolean True if the index was built from the fasta file
+    #
+    def load(self):
+        signature = self._getSignature()
+        if os.path.exists(self._indexFileName):
+            indexFile = open(self._indexFileName, "r")
+            if indexFile.readline().rstrip("\n") == signature:
+                self._lRecords = []
+                for line in indexFile:
+                    offset, byteSize, seqLength, isValid, header = line.rstrip("\n").split("\t", 4)
+                    self._lRecords.append((header, int(offset), int(byteSize), int(seqLength), isValid == "1"))
+                indexFile.close()
+                return False
+            indexFile.close()
+        self.build()
+        try:
+            self.save(signature)
+        except IOError:
+            pass
+        return True
+
+    def build(self):
+        self._lRecords = []
+        inFile = open(self._fastaFileName, "r")
+        header = None
+        offset = 0
+        start = 0
+        seqLength = 0
+        line = inFile.readline()
+        while line:
+            if line.startswith(">"):
+                if header is not None:
+                    self._appendRecord(header, start, offset - start, seqLength)
+                header = line[1:].strip()
+                start = offset
+                seqLength = 0
+            else:
+                seqLength += len(line.strip())
+            offset += len(line)
+            line = inFile.readline()
+        if header is not None:
+            self._appendRecord(header, start, offset - start, seqLength)
+        inFile.close()
+
+    def _appendRecord(self, header, offset, byteSize, seqLength):
+        isValid = self.WRONG_HEADER_CHARS.search(header) is None
+        self._lRecords.append((header, offset, byteSize, seqLength, isValid))
+
+    def save(self, signature = ""):
+        if signature == "":
+            signature = self._getSignature()
+        tmpFileName = "%s.tmp" % self._indexFileName
+        indexFile = open(tmpFileName, "w")
+        indexFile.write("%s\n" % signature)
+        for header, offset, byteSize, seqLength, isValid in self._lRecords:
+            indexFile.write("%i\t%i\t%i\t%i\t%s\n" % (offset, byteSize, seqLength, int(isValid), header))
+        indexFile.close()
+        os.rename(tmpFileName, self._indexFileName)
+
+    # # @return list of (header, offset, byteSize, seqLength, isValid) tuples, in file order
+    #
+    def getRecords(self):
+        return self._lRecords
+
+    def getNbSeq(self):
+        return len(self._lRecords)
+
+    def getWrongHeaders(self):
+        return [record[0] for record in self._lRecords if not record[4]]
+
+    # # @return list of (offset, size) byte ranges covering the given records, contiguous records being merged
+    #
+    def getRanges(self, lRecords):
+        lRanges = []
+        for record in sorted(lRecords, key = lambda record: record[1]):
+            if lRanges and lRanges[-1][0] + lRanges[-1][1] == record[1]:
+                lRanges[-1] = (lRanges[-1][0], lRanges[-1][1] + record[2])
+            else:
+                lRanges.append((record[1], record[2]))
+        return lRanges
+
+    # # Read the given records by offset in the indexed file.
+    #
+    # @return iterator on (record, sequence) tuples
+    #
+    def iterSequences(self, lRecords):
+        inFile = open(self._fastaFileName, "r")
+        for record in lRecords:
+            inFile.seek(record[1])
+            lLines = inFile.read(record[2]).split("\n")
+            yield record, "".join([line.strip() for line in lLines[1:]])
+        inFile.close()
+
+    # # Write the given records into a fasta file, reading them by offset in the indexed file.
+    #
+    def writeRecords(self, lRecords, outFileName):
+        inFile = open(self._fastaFileName, "r")
+        outFile = open(outFileName, "w")
+        for offset, size in self.getRanges(lRecords):
+            inFile.seek(offset)
+            outFile.write(inFile.read(size))
+        outFile.close()
+        inFile.close()
+
+####ResidueBalancedSplitter
+#
+# Split a fasta file into batches of balanced expected cost, the heaviest batches first
+#
+class ResidueBalancedSplitter(object):
+
+    def __init__(self, iFastaIndex, nbBatches, seqCostOverhead = SEQ_COST_OVERHEAD):
+        self._iFastaIndex = iFastaIndex
+        self._nbBatches = max(1, nbBatches)
+        self._seqCostOverhead = seqCostOverhead
+
+    def getCost(self, seqLength):
+        return seqLength + self._seqCostOverhead
+
+    # # Assign records to batches, longest processing time first, each record going to the least loaded batch.
+    #
+    # @return list of (cost, list of records) sorted by decreasing cost, records kept in file order
+    #
+    def assign(self, lRecords):
+        nbBatches = min(self._nbBatches, len(lRecords))
+        lBatches = [[0, i, []] for i in range(nbBatches)]
+        for record in sorted(lRecords, key = lambda record: record[3], reverse = True):
+            lightest = min(lBatches)
+            lightest[0] += self.getCost(record[3])
+            lightest[2].append(record)
+        lBatches.sort(key = lambda batch: (-batch[0], batch[1]))
+        return [(cost, sorted(lBatchRecords, key = lambda record: record[1])) for cost, index, lBatchRecords in lBatches]
+
+    # # Name batches and write one fasta file per batch, reading records by offset in the indexed fasta file.
+    #
+    # @param doWrite boolean False to only get the offset ranges of the batches, without writing any file
+    # @return list of (batch file name, cost, list of records) sorted by decreasing cost
+    #
+    def split(self, outDir = "batches", prefix = "batch_", doWrite = True):
+        if doWrite:
+            if os.path.exists(outDir):
+                shutil.rmtree(outDir)
+            os.makedirs(outDir)
+        lBatches = []
+        count = 0
+        for cost, lBatchRecords in self.assign(self._iFastaIndex.getRecords()):
+            count += 1
+            batchFileName = "%s%i.fa" % (prefix, count)
+            if doWrite:
+                self._iFastaIndex.writeRecords(lBatchRecords, os.path.join(outDir, batchFileName))
+            lBatches.append((batchFileName, cost, lBatchRecords))
+        return lBatches
+
+####LocalJobExecutor
+#
+# Run shell commands on a bounded pool of local processes, without job table nor scheduler.
+# Jobs are handed out to idle workers in list order. Once no job is waiting, a job running longer than speculativeFactor
+# times the median job time is relaunched by an idle worker, and the first copy to succeed wins.
+#
+class LocalJobExecutor(object):
+
+    _MIN_POLL_INTERVAL = 0.01
+    _MIN_SPECULATIVE_TIME = 1.0
+
+    def __init__(self, nbWorkers = 1, pollInterval = 0.5, log = None, speculativeFactor = 0):
+        self._nbWorkers = max(1, nbWorkers)
+        self._pollInterval = pollInterval
+        self._log = log
+        self._speculativeFactor = speculativeFactor
+        self._dStartTimes = {}
+        self._dWorkDirs = {}
+        self._nbSpeculativeJobs = 0
+        self._nbSpeculativeWins = 0
+
+    # # @return float time at which the job of the given index was launched
+    #
+    def getStartTime(self, index):
+        return self._dStartTimes[index]
+
+    # # @return string working directory of the copy of the job that ended it
+    #
+    def getWorkDir(self, index):
+        return self._dWorkDirs[index]
+
+    # # @return (number of speculative copies launched, number of them finishing first)
+    #
+    def getSpeculativeCounts(self):
+        return self._nbSpeculativeJobs, self._nbSpeculativeWins
+
+    def _launch(self, jobName, cmd, workDir):
+        logFile = open(os.path.join(workDir, "%s.log" % jobName), "w")
+        if self._log:
+            self._log.debug("Launch job '%s': %s" % (jobName, cmd))
+        # own process group, so that a losing copy is killed with its children
+        process = subprocess.Popen(cmd, shell = True, cwd = workDir, stdout = logFile, stderr = subprocess.STDOUT, preexec_fn = os.setsid)
+        return process, logFile, time.time(), workDir
+
+    def _kill(self, process, logFile):
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except OSError:
+            pass
+        process.wait()
+        logFile.close()
+
+    # # @return index of a running job to relaunch, None if there is none
+    #
+    def _getStraggler(self, dRunning, lStatus, dSpeculated, getSpeculativeJob):
+        if self._speculativeFactor <= 0 or getSpeculativeJob is None:
+            return None
+        lElapsed = sorted([status[2] for status in lStatus if status is not None and status[1] == 0])
+        if not lElapsed:
+            return None
+        threshold = max(self._speculativeFactor * lElapsed[len(lElapsed) / 2], self._MIN_SPECULATIVE_TIME)
+        now = time.time()
+        lCandidates = [(self._dStartTimes[index], index) for index, copyIndex in dRunning.keys() if index not in dSpeculated and now - self._dStartTimes[index] > threshold]
+        if not lCandidates:
+            return None
+        return min(lCandidates)[1]
+
+    # # Launch jobs and wait for all of them.
+    #
+    # @param lJobs list of (jobName, command, workDir) tuples
+    # @param onJobEnd function called with (index, jobName, exit status, elapsed time) when a job ends [optional]
+    # @param getSpeculativeJob function called with the index of a straggling job, returning the (jobName, command, workDir) of its copy [optional]
+    # @return list of (jobName, exit status, elapsed time in seconds) tuples, in the same order as lJobs
+    #
+    def run(self, lJobs, onJobEnd = None, getSpeculativeJob = None):
+        self._dStartTimes = {}
+        self._dWorkDirs = {}
+        self._nbSpeculativeJobs = 0
+        self._nbSpeculativeWins = 0
+        lPending = list(enumerate(lJobs))
+        dRunning = {}
+        dSpeculated = {}
+        lStatus = [None] * len(lJobs)
+        # short jobs are polled often, long ones up to every pollInterval
+        sleepTime = self._MIN_POLL_INTERVAL
+        while lPending or dRunning:
+            while lPending and len(dRunning) < self._nbWorkers:
+                index, (jobName, cmd, workDir) = lPending.pop(0)
+                dRunning[(index, 0)] = (jobName,) + self._launch(jobName, cmd, workDir)
+                self._dStartTimes[index] = dRunning[(index, 0)][3]
+            while not lPending and len(dRunning) < self._nbWorkers:
+                index = self._getStraggler(dRunning, lStatus, dSpeculated, getSpeculativeJob)
+                if index is None:
+                    break
+                jobName, cmd, workDir = getSpeculativeJob(index)
+                if self._log:
+                    self._log.info("Job '%s' is straggling, relaunch it as '%s'" % (lJobs[index][0], jobName))
+                dRunning[(index, 1)] = (jobName,) + self._launch(jobName, cmd, workDir)
+                dSpeculated[index] = True
+                self._nbSpeculativeJobs += 1
+            for index, copyIndex in sorted(dRunning.keys()):
+                if (index, copyIndex) not in dRunning:
+                    continue
+                jobName, process, logFile, startTime, workDir = dRunning[(index, copyIndex)]
+                if process.poll() is None:
+                    continue
+                logFile.close()
+                del dRunning[(index, copyIndex)]
+                sleepTime = self._MIN_POLL_INTERVAL
+                otherCopy = (index, 1 - copyIndex)
+                if process.returncode != 0 and otherCopy in dRunning:
+                    # the other copy may still succeed
+                    continue
+                if otherCopy in dRunning:
+                    self._kill(dRunning[otherCopy][1], dRunning[otherCopy][2])
+                    del dRunning[otherCopy]
+                if copyIndex == 1 and process.returncode == 0:
+                    self._nbSpeculativeWins += 1
+                self._dWorkDirs[index] = workDir
+                lStatus[index] = (lJobs[index][0], process.returncode, time.time() - self._dStartTimes[index])
+                if onJobEnd is not None:
+                    onJobEnd(index, *lStatus[index])
+            if dRunning and (not lPending or len(dRunning) >= self._nbWorkers):
+                time.sleep(sleepTime)
+                sleepTime = min(2 * sleepTime, self._pollInterval)
+        return lStatus
+
+# # @return string md5 of the file content
+#
+def getFileMd5(fileName):
+    md5 = hashlib.md5()
+    inFile = open(fileName, "rb")
+    block = inFile.read(1 << 20)
+    while block:
+        md5.update(block)
+        block = inFile.read(1 << 20)
+    inFile.close()
+    return md5.hexdigest()
+
+####RunManifest
+#
+# Record of the completed parts of a run (steps, batches, post processing stages) with the content hash of their
+# artifacts, so that a resumed run only recomputes stale or missing parts
+#
+class RunManifest(object):
+
+    def __init__(self, manifestFileName):
+        self._manifestFileName = manifestFileName
+        self._dEntries = {}
+        self._dFileHashes = {}
+
+    def load(self):
+        if os.path.exists(self._manifestFileName):
+            manifestFile = open(self._manifestFileName, "r")
+            self._dEntries = json.load(manifestFile)
+            manifestFile.close()
+
+    def save(self):
+        tmpFileName = "%s.tmp" % self._manifestFileName
+        manifestFile = open(tmpFileName, "w")
+        json.dump(self._dEntries, manifestFile, indent = 1, sort_keys = True)
+        manifestFile.close()
+        os.rename(tmpFileName, self._manifestFileName)
+
+    # # @return string md5 of the file content, '' if the file does not exist. Hashes are cached on size and date.
+    #
+    def getFileHash(self, fileName):
+        if not fileName or not os.path.exists(fileName):
+            return ""
+        stat = os.stat(fileName)
+        signature = (os.path.abspath(fileName), stat.st_size, stat.st_mtime)
+        if signature not in self._dFileHashes:
+            self._dFileHashes[signature] = getFileMd5(fileName)
+        return self._dFileHashes[signature]
+
+    # # @return string key identifying a computation from its parameters and the content of its input files
+    #
+    def getKey(self, lItems, lInFileNames = []):
+        md5 = hashlib.md5()
+        for item in lItems:
+            md5.update("%s\n" % item)
+        for fileName in lInFileNames:
+            md5.update("%s\n" % self.getFileHash(fileName))
+        return md5.hexdigest()
+
+    # # @return boolean True if the entry was computed with this key and its artifacts are present and unchanged
+    #
+    def isDone(self, name, key):
+        dEntry = self._dEntries.get(name)
+        if dEntry is None or dEntry["key"] != key or "pending" in dEntry:
+            return False
+        for fileName, fileHash in dEntry["artifacts"].items():
+            if not os.path.exists(fileName) or self.getFileHash(fileName) != fileHash:
+                return False
+        return True
+
+    def setDone(self, name, key, lArtifacts = []):
+        for fileName in lArtifacts:
+            if not os.path.exists(fileName):
+                raise Exception("ERROR: artifact '%s' of '%s' not found, can not record it as done" % (fileName, name))
+        self._dEntries[name] = {"key": key, "artifacts": dict([(fileName, self.getFileHash(fileName)) for fileName in lArtifacts])}
+        self.save()
+
+    # # Record an entry launched in another process, which writes its artifacts when it succeeds.
+    #
+    def setLaunched(self, name, key, lArtifacts):
+        self._dEntries[name] = {"key": key, "artifacts": {}, "pending": lArtifacts}
+        self.save()
+
+    # # Record as done an entry launched with this key whose artifacts have all been written since.
+    #
+    # @return boolean True if the entry is done
+    #
+    def setDoneIfWritten(self, name, key):
+        dEntry = self._dEntries.get(name)
+        if dEntry is None or dEntry["key"] != key or "pending" not in dEntry:
+            return False
+        for fileName in dEntry["pending"]:
+            if not os.path.exists(fileName):
+                return False
+        self.setDone(name, key, dEntry["pending"])
+        return True
+
+####BankCache
+#
+# Cache of prepared banks (formatted BLAST databases, pressed HMM profiles) shared by projects and keyed on bank content.
+# Entries are built once under a lock, then only read. It also records which project tables were loaded with which banks.
+#
+class BankCache(object):
+
+    def __init__(self, cacheDir, blast = "blastplus", log = None):
+        self._cacheDir = os.path.abspath(cacheDir)
+        self._blast = blast
+        self._log = log
+        self._dFingerprints = {}
+
+    # # @return list of commands formatting a bank in the current directory
+    #
+    def getFormatCommands(self, bankFileName, bankType):
+        if bankType == "hmm":
+            return ["hmmpress %s" % bankFileName]
+        if self._blast == "blastplus":
+            return ["makeblastdb -in %s -dbtype %s" % (bankFileName, {"nucl": "nucl", "prot": "prot"}[bankType])]
+        if self._blast == "wu":
+            return ["xdformat -%s %s" % ({"nucl": "n", "prot": "p"}[bankType], bankFileName)]
+        return ["formatdb -i %s -p %s" % (bankFileName, {"nucl": "F", "prot": "T"}[bankType])]
+
+    def _lock(self, lockFileName):
+        lockFile = open(lockFileName, "a")
+        fcntl.flock(lockFile, fcntl.LOCK_EX)
+        return lockFile
+
+    def _unlock(self, lockFile):
+        fcntl.flock(lockFile, fcntl.LOCK_UN)
+        lockFile.close()
+
+    def _loadJson(self, fileName):
+        if os.path.exists(fileName):
+            return json.load(open(fileName, "r"))
+        return {}
+
+    def _saveJson(self, dData, fileName):
+        tmpFileName = "%s.%i.tmp" % (fileName, os.getpid())
+        outFile = open(tmpFileName, "w")
+        json.dump(dData, outFile, indent = 1, sort_keys = True)
+        outFile.close()
+        os.rename(tmpFileName, fileName)
+
+    # # @return string md5 of the bank content, only recomputed when the bank path, size or date change
+    #
+    def getFingerprint(self, bankFileName):
+        stat = os.stat(bankFileName)
+        signature = "%s\t%i\t%i" % (os.path.abspath(bankFileName), stat.st_size, int(stat.st_mtime))
+        if signature not in self._dFingerprints:
+            fingerprintsFileName = os.path.join(self._cacheDir, "fingerprints.json")
+            dFingerprints = self._loadJson(fingerprintsFileName)
+            if signature not in dFingerprints:
+                fingerprint = getFileMd5(bankFileName)
+                if not os.path.exists(self._cacheDir):
+                    os.makedirs(self._cacheDir)
+                lockFile = self._lock(os.path.join(self._cacheDir, "fingerprints.lock"))
+                dFingerprints = self._loadJson(fingerprintsFileName)
+                dFingerprints[signature] = fingerprint
+                self._saveJson(dFingerprints, fingerprintsFileName)
+                self._unlock(lockFile)
+            self._dFingerprints[signature] = dFingerprints[signature]
+        return self._dFingerprints[signature]
+
+    # # Build the cache entry of a bank if it does not exist yet.
+    #
+    # @param bankType string 'nucl', 'prot' or 'hmm'
+    # @return string directory of the entry, with the bank and its index files
+    #
+    def prepare(self, bankFileName, bankType):
+        if not os.path.exists(self._cacheDir):
+            os.makedirs(self._cacheDir)
+        fingerprint = self.getFingerprint(bankFileName)
+        entryDir = os.path.join(self._cacheDir, "%s_%s_%s" % (fingerprint, bankType, self._blast))
+        if os.path.exists(entryDir):
+            return entryDir
+        lockFile = self._lock("%s.lock" % entryDir)
+        try:
+            if not os.path.exists(entryDir):
+                if self._log:
+                    self._log.info("Prepare bank '%s' in cache '%s'" % (bankFileName, entryDir))
+                tmpDir = "%s.%i.tmp" % (entryDir, os.getpid())
+                if os.path.exists(tmpDir):
+                    shutil.rmtree(tmpDir)
+                os.makedirs(tmpDir)
+                shutil.copy(bankFileName, tmpDir)
+                for cmd in self.getFormatCommands(os.path.basename(bankFileName), bankType):
+                    if subprocess.call(cmd, shell = True, cwd = tmpDir) != 0:
+                        shutil.rmtree(tmpDir)
+                        raise Exception("ERROR: '%s' failed on bank '%s'" % (cmd, bankFileName))
+                os.rename(tmpDir, entryDir)
+        finally:
+            self._unlock(lockFile)
+        return entryDir
+
+    # # Link the bank and its index files of a cache entry in a directory, keeping files already there.
+    #
+    def link(self, entryDir, targetDir = "."):
+        for fileName in os.listdir(entryDir):
+            targetFileName = os.path.join(targetDir, fileName)
+            if os.path.islink(targetFileName):
+                os.remove(targetFileName)
+            if not os.path.exists(targetFileName):
+                os.symlink(os.path.join(entryDir, fileName), targetFileName)
+
+    # # @return boolean True if the bank tables of a project were recorded as loaded with the same banks. The caller
+    # checks that the tables are still in the database.
+    #
+    def isTableLoaded(self, tableKey, banksFingerprint):
+        return self._loadJson(os.path.join(self._cacheDir, "tables.json")).get(tableKey) == banksFingerprint
+
+    def setTableLoaded(self, tableKey, banksFingerprint):
+        tablesFileName = os.path.join(self._cacheDir, "tables.json")
+        lockFile = self._lock(os.path.join(self._cacheDir, "tables.lock"))
+        dTables = self._loadJson(tablesFileName)
+        dTables[tableKey] = banksFingerprint
+        self._saveJson(dTables, tablesFileName)
+        self._unlock(lockFile)
+
+####ClassifCache
+#
+# Persistent cache of classif lines keyed on sequence content and classification settings, with least recently used
+# eviction beyond a maximum number of entries
+#
+class ClassifCache(object):
+
+    def __init__(self, cacheFileName, settingsFingerprint = "", maxEntries = 1000000):
+        self._cacheFileName = cacheFileName
+        self._settingsFingerprint = settingsFingerprint
+        self._maxEntries = maxEntries
+        self._conn = None
+
+    def open(self):
+        self._conn = sqlite3.connect(self._cacheFileName, timeout = 60)
+        self._conn.text_factory = str
+        self._conn.execute("CREATE TABLE IF NOT EXISTS classif (key TEXT PRIMARY KEY, classif TEXT, last_used REAL)")
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+        self._conn = None
+
+    def getKey(self, sequence):
+        return hashlib.sha1("%s\n%s" % (self._settingsFingerprint, sequence.upper())).hexdigest()
+
+    # # @return dict classif line without sequence name (column 2 to the end) for each of the given keys found in the cache
+    #
+    def get(self, lKeys):
+        dClassif = {}
+        now = time.time()
+        for i in range(0, len(lKeys), 500):
+            lChunk = lKeys[i:i + 500]
+            query = "SELECT key, classif FROM classif WHERE key IN (%s)" % ",".join(["?"] * len(lChunk))
+            for key, classif in self._conn.execute(query, lChunk):
+                dClassif[key] = classif
+            self._conn.executemany("UPDATE classif SET last_used = ? WHERE key = ?", [(now, key) for key in lChunk if key in dClassif])
+        self._conn.commit()
+        return dClassif
+
+    # # @param dClassif dict classif line without sequence name for each key
+    #
+    def put(self, dClassif):
+        now = time.time()
+        self._conn.executemany("INSERT OR REPLACE INTO classif VALUES (?, ?, ?)", [(key, classif, now) for key, classif in dClassif.items()])
+        nbEntries = self._conn.execute("SELECT COUNT(*) FROM classif").fetchone()[0]
+        if nbEntries > self._maxEntries:
+            self._conn.execute("DELETE FROM classif WHERE key IN (SELECT key FROM classif ORDER BY last_used LIMIT ?)", (nbEntries - self._maxEntries,))
+        self._conn.commit()
+
+# Columns of a classif line
+CLASSIF_NAME, CLASSIF_LENGTH, CLASSIF_STRAND, CLASSIF_STATUS, CLASSIF_CLASS, CLASSIF_ORDER, CLASSIF_COMPLETENESS, CLASSIF_EVIDENCE = range(8)
+
+####SQLiteDb
+#
+# Embedded database file holding the final classif table of a run, instead of the MySQL server of [repet_env].
+# Tables are loaded by bulk inserts in one transaction.
+#
+class SQLiteDb(object):
+
+    CLASSIF_COLUMNS = "seq_name VARCHAR(255), length INT, strand CHAR(1), status VARCHAR(255), class_classif VARCHAR(255), order_classif VARCHAR(255), completeness VARCHAR(255), evidences TEXT"
+    BULK_SIZE = 10000
+
+    def __init__(self, dbFileName):
+        self._dbFileName = dbFileName
+        self._conn = None
+
+    def open(self):
+        self._conn = sqlite3.connect(self._dbFileName, timeout = 60)
+        self._conn.text_factory = str
+
+    def close(self):
+        self._conn.close()
+        self._conn = None
+
+    def _iterClassifRows(self, classifFileName):
+        classifFile = open(classifFileName, "r")
+        for line in classifFile:
+            lColumns = line.rstrip("\n").split("\t", CLASSIF_EVIDENCE)
+            if len(lColumns) <= CLASSIF_EVIDENCE:
+                continue
+            yield lColumns
+        classifFile.close()
+
+    # # Replace a table with the content of a classif file.
+    #
+    # @return integer number of rows
+    #
+    def createClassifTable(self, tableName, classifFileName):
+        # the table is rebuilt from the classif file if the run is interrupted
+        self._conn.execute("PRAGMA synchronous = OFF")
+        self._conn.execute("DROP TABLE IF EXISTS %s" % tableName)
+        self._conn.execute("CREATE TABLE %s (%s)" % (tableName, self.CLASSIF_COLUMNS))
+        insert = "INSERT INTO %s VALUES (%s)" % (tableName, ",".join(["?"] * (CLASSIF_EVIDENCE + 1)))
+        nbRows = 0
+        lRows = []
+        for lColumns in self._iterClassifRows(classifFileName):
+            lRows.append(lColumns)
+            if len(lRows) == self.BULK_SIZE:
+                self._conn.executemany(insert, lRows)
+                nbRows += len(lRows)
+                lRows = []
+        self._conn.executemany(insert, lRows)
+        nbRows += len(lRows)
+        self._conn.execute("CREATE INDEX %s_seq_name ON %s (seq_name)" % (tableName, tableName))
+        self._conn.commit()
+        self._conn.execute("PRAGMA synchronous = FULL")
+        return nbRows
+
+# # Write a fasta record, sequence on lines of 60 characters.
+#
+def writeFastaRecord(outFile, header, sequence, lineLength = 60):
+    outFile.write(">%s\n" % header)
+    for i in range(0, len(sequence), lineLength):
+        outFile.write("%s\n" % sequence[i:i + lineLength])
+
+
+####ClassifUniqFilter
+#
+# Keep the classif lines of the sequences of a fasta file, in fasta order, as GetClassifUniq does, reading only the
+# headers of the fasta file from its index
+#
+class ClassifUniqFilter(object):
+
+    def __init__(self, fastaFileName, classifFileName, outClassifFileName):
+        self._fastaFileName = fastaFileName
+        self._classifFileName = classifFileName
+        self._outClassifFileName = outClassifFileName
+
+    def run(self):
+        dClassifLines = {}
+        classifFile = open(self._classifFileName, "r")
+        for line in classifFile:
+            header = line.split("\t", 1)[0].rstrip("\n")
+            if header:
+                dClassifLines[header] = line.rstrip("\n")
+        classifFile.close()
+
+        iFastaIndex = FastaIndex(self._fastaFileName)
+        iFastaIndex.load()
+        outFile = open(self._outClassifFileName, "w")
+        for record in iFastaIndex.getRecords():
+            if record[0] in dClassifLines:
+                outFile.write("%s\n" % dClassifLines[record[0]])
+        outFile.close()
+
+# # @return set of the canonical k-mer minimizers of a sequence, as hashes. Two sequences sharing an exact match of at
+# least kmerSize + windowSize - 1 bases, on either strand, share at least one minimizer.
+#
+def getCanonicalMinimizers(sequence, kmerSize, windowSize):
+    sequence = sequence.upper()
+    reverseSequence = sequence.translate(COMPLEMENT)[::-1]
+    nbKmers = len(sequence) - kmerSize + 1
+    if nbKmers <= 0:
+        return set()
+    lKmers = [sequence[i:i + kmerSize] for i in xrange(nbKmers)]
+    lReverseKmers = [reverseSequence[i:i + kmerSize] for i in xrange(nbKmers)]
+    lReverseKmers.reverse()
+    lHashes = map(hash, map(min, lKmers, lReverseKmers))
+    if windowSize == 1 or nbKmers <= windowSize:
+        return set([min(lHashes)]) if windowSize > 1 else set(lHashes)
+    return set(map(min, *[lHashes[i:nbKmers - windowSize + 1 + i] for i in range(windowSize)]))
+
+def _getCanonicalMinimizers(lArgs):
+    return getCanonicalMinimizers(*lArgs)
+
+# # Run RemoveRedundancyBasedOnCI in its own directory, for a pool of processes.
+#
+def _removeRedundancyInDir(lArgs):
+    workDir, fastaFileName, classifFileName, configFileName, outFileName, doClean, verbosity = lArgs
+    os.chdir(workDir)
+    RemoveRedundancyBasedOnCI(fastaFileName, classifFileName, configFileName, outFileName = outFileName, doClean = doClean, verbosity = verbosity).run()
+    return outFileName
+
+####RedundancyPrefilter
+#
+# Group sequences into components of candidate redundant pairs, so that redundancy is searched only within components.
+# Sequences are linked when they share a canonical k-mer minimizer. k and the window are chosen so that any alignment
+# reaching the identity and coverage thresholds contains an exact match long enough to share one.
+#
+class RedundancyPrefilter(object):
+
+    MIN_KMER_SIZE = 15
+    MAX_KMER_SIZE = 31
+
+    # # @param identity float minimum identity of a redundant pair, in percent
+    # @param coverage float minimum coverage of the shorter sequence by the alignment, in percent
+    #
+    def __init__(self, identity, coverage, nbProcesses = 1):
+        self._identity = identity
+        self._coverage = coverage
+        self._nbProcesses = max(1, nbProcesses)
+        self._kmerSize = 0
+        self._windowSize = 0
+
+    # # An alignment of length L with at most e = (1 - identity) * L mismatches or gaps is split by them into e + 1 runs
+    # of identical bases, the longest one having at least (L - e) / (e + 1) bases, a bound increasing with L.
+    #
+    # @param minLength integer length of the shortest sequence
+    # @return integer length of the exact match shared by any redundant pair
+    #
+    def getExactMatchLength(self, minLength):
+        alignLength = int(math.ceil(self._coverage / 100.0 * minLength))
+        errorRate = 1 - self._identity / 100.0
+        if errorRate <= 0:
+            return alignLength
+        return int(math.ceil(self._identity / 100.0 * alignLength / (errorRate * alignLength + 1) - 1e-9))
+
+    # # Choose the k-mer size and the minimizer window. k-mers are as long as possible, shorter ones linking unrelated
+    # sequences by chance in large libraries, the window taking the rest of the exact match.
+    #
+    # @return boolean False if the guaranteed exact match is too short for the prefilter to be selective
+    #
+    def setParameters(self, minLength):
+        exactMatchLength = self.getExactMatchLength(minLength)
+        if exactMatchLength < self.MIN_KMER_SIZE:
+            return False
+        self._kmerSize = min(self.MAX_KMER_SIZE, exactMatchLength)
+        self._windowSize = exactMatchLength - self._kmerSize + 1
+        return True
+
+    def getParameters(self):
+        return self._kmerSize, self._windowSize
+
+    # # @param lSequences list of sequences
+    # @return list of components, each one a list of sequence indices in increasing order, in order of their first sequence
+    #
+    def getComponents(self, lSequences):
+        lParents = range(len(lSequences))
+        def find(index):
+            while lParents[index] != index:
+                lParents[index] = lParents[lParents[index]]
+                index = lParents[index]
+            return index
+        lArgs = [(sequence, self._kmerSize, self._windowSize) for sequence in lSequences]
+        if self._nbProcesses > 1:
+            iPool = multiprocessing.Pool(self._nbProcesses)
+            iterMinimizers = iPool.imap(_getCanonicalMinimizers, lArgs, 64)
+        else:
+            iPool = None
+            iterMinimizers = (_getCanonicalMinimizers(args) for args in lArgs)
+        dOwners = {}
+        index = 0
+        try:
+            for sMinimizers in iterMinimizers:
+                for minimizer in sMinimizers:
+                    owner = dOwners.setdefault(minimizer, index)
+                    if owner != index:
+                        rootOwner = find(owner)
+                        rootIndex = find(index)
+                        if rootOwner != rootIndex:
+                            lParents[max(rootOwner, rootIndex)] = min(rootOwner, rootIndex)
+                index += 1
+        finally:
+            # the worker processes are not left behind if a worker fails, e.g. in a long-running service
+            if iPool is not None:
+                iPool.terminate()
+                iPool.join()
+        dComponents = {}
+        for index in range(len(lSequences)):
+            dComponents.setdefault(find(index), []).append(index)
+        return [dComponents[root] for root in sorted(dComponents.keys())]
+
+# # @return dict of resource usage of the process and its waited children:
+# - cpuTime: CPU time (s) of the process and its children
+# - processPeakRss: high-water mark (kB) of the process or of its largest child since the process started, not of a span
+# - selfBytesRead, selfBytesWritten: bytes read and written by the process (rchar/wchar), page cache included
+# - childrenDiskBytesRead, childrenDiskBytesWritten: block device I/O of the children, reads served by the page cache
+#   not counted
+#
+def getResourceUsage():
+    selfUsage = resource.getrusage(resource.RUSAGE_SELF)
+    childrenUsage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    dUsage = {"cpuTime": selfUsage.ru_utime + selfUsage.ru_stime + childrenUsage.ru_utime + childrenUsage.ru_stime,
+              "processPeakRss": max(selfUsage.ru_maxrss, childrenUsage.ru_maxrss),
+              "selfBytesRead": 0,
+              "selfBytesWritten": 0,
+              "childrenDiskBytesRead": 512 * childrenUsage.ru_inblock,
+              "childrenDiskBytesWritten": 512 * childrenUsage.ru_oublock}
+    if os.path.exists("/proc/self/io"):
+        ioFile = open("/proc/self/io", "r")
+        for line in ioFile:
+            key, value = line.split(":")
+            if key == "rchar":
+                dUsage["selfBytesRead"] = int(value)
+            elif key == "wchar":
+                dUsage["selfBytesWritten"] = int(value)
+        ioFile.close()
+    return dUsage
+
+####TraceSpan
+#
+class TraceSpan(object):
+
+    def __init__(self, iTracer, name, category, dArgs):
+        self._iTracer = iTracer
+        self._name = name
+        self._category = category
+        self._dArgs = dArgs
+        self._startTime = time.time()
+        self._dStartUsage = getResourceUsage()
+
+    def stop(self):
+        dUsage = getResourceUsage()
+        dArgs = dict(self._dArgs)
+        dArgs["cpuTime"] = dUsage["cpuTime"] - self._dStartUsage["cpuTime"]
+        dArgs["processPeakRss"] = dUsage["processPeakRss"]
+        for key in ["selfBytesRead", "selfBytesWritten", "childrenDiskBytesRead", "childrenDiskBytesWritten"]:
+            dArgs[key] = dUsage[key] - self._dStartUsage[key]
+        self._iTracer.addSpan(self._name, self._category, self._startTime, time.time() - self._startTime, dArgs)
+
+####RunTracer
+#
+# Record spans of a run (wall time, CPU time, peak RSS, bytes read and written) and save them as JSON and as a
+# Chrome trace (chrome://tracing, Perfetto)
+#
+class RunTracer(object):
+
+    def __init__(self):
+        self._lSpans = []
+
+    def start(self, name, category = "run", **dArgs):
+        return TraceSpan(self, name, category, dArgs)
+
+    # # Record a span measured elsewhere (e.g. a job run by another process).
+    #
+    # @param lane integer row of the span in the Chrome trace, 0 for the main process
+    #
+    def addSpan(self, name, category, startTime, duration, dArgs = {}, lane = 0):
+        self._lSpans.append({"name": name, "category": category, "start": startTime, "duration": duration, "lane": lane, "args": dArgs})
+
+    def write(self, jsonFileName, chromeTraceFileName):
+        jsonFile = open(jsonFileName, "w")
+        json.dump({"spans": self._lSpans}, jsonFile, indent = 1, sort_keys = True)
+        jsonFile.close()
+        lEvents = []
+        for dSpan in self._lSpans:
+            lEvents.append({"name": dSpan["name"], "cat": dSpan["category"], "ph": "X", "pid": os.getpid(), "tid": dSpan["lane"],
+                            "ts": int(dSpan["start"] * 1e6), "dur": int(dSpan["duration"] * 1e6), "args": dSpan["args"]})
+        chromeTraceFile = open(chromeTraceFileName, "w")
+        json.dump({"traceEvents": lEvents, "displayTimeUnit": "ms"}, chromeTraceFile)
+        chromeTraceFile.close()
+
+####NullTracer
+#
+# Tracer used when tracing is off: nothing is measured nor recorded
+#
+class NullTracer(object):
+
+    class NullSpan(object):
+        def stop(self):
+            pass
+
+    NULL_SPAN = NullSpan()
+
+    def start(self, name, category = "run", **dArgs):
+        return self.NULL_SPAN
+
+    def addSpan(self, name, category, startTime, duration, dArgs = {}, lane = 0):
+        pass
+
+    def write(self, jsonFileName, chromeTraceFileName):
+        pass
+
+####ClassificationRequestHandler
+#
+# Read a JSON request line, queue its job for the service and answer with the JSON result line once the job is done
+#
+class ClassificationRequestHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            dRequest = json.loads(self.rfile.readline())
+        except ValueError:
+            dResult = {"status": "error", "message": "request is not a JSON line"}
+        else:
+            if dRequest.get("command") == "status":
+                dResult = {"status": "ok", "waiting": self.server.qJobs.qsize()}
+            else:
+                qResult = Queue.Queue(1)
+                self.server.qJobs.put((dRequest, qResult))
+                dResult = qResult.get()
+        self.wfile.write("%s\n" % json.dumps(dResult))
+
+class ThreadingUnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+class ThreadingTCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
 ####PASTEClassifier
 #
 class PASTEClassifier(object):
@@ -88,6 +1040,38 @@ class PASTEClassifier(object):
         self._classifFileName = ""
         self._projectNameSuffix = ""
 
+        self._executor = "launcher"
+        self._nbLocalWorkers = 0
+        self._iFastaIndex = None
+        self._staging = "copy"
+        self._resume = False
+        self._iManifest = None
+        self._runKey = ""
+        self._cacheFileName = ""
+        self._cacheSize = 1000000
+        self._pipeline = False
+        self._dynamic = False
+        self._speculativeFactor = 3.0
+        self._fusedPostProcess = False
+        self._trace = False
+        self._bankCacheDir = ""
+        self._classifTableBackend = ""
+        self._redundancyPrefilter = False
+        self._serveAddress = ""
+        self._submitAddress = ""
+        self._options = None
+        self._bankDir = ""
+        self._outFastaFileName = ""
+        self._outClassifFileName = ""
+        self._iBankCache = None
+        self._banksFingerprint = ""
+        self._iTracer = NullTracer()
+        self._iClassifCache = None
+        self._iExecutor = None
+        self._isServiceJob = False
+        self._dHeader2CacheKey = {}
+        self._lInputFasta = None
+
         self._projectName = ""
         self._log = LoggerFactory.createLogger("%s.%s" % (LOG_DEPTH, self.__class__.__name__), self._verbosity)
 
@@ -102,23 +1086,60 @@ class PASTEClassifier(object):
         epilog += "\n"
         epilog += "Example 2: launch without clean temporary files\n"
         epilog += "\t$ PASTEClassifier.py -i consensus.fa -C PASTEClassifier.cfg \n"
+        epilog += "\n"
+        epilog += "Example 3: launch in parallel on 16 local processes (no job table nor scheduler)\n"
+        epilog += "\t$ PASTEClassifier.py -i consensus.fa -C PASTEClassifier.cfg -p -e local:16\n"
+        epilog += "\n"
+        epilog += "Example 4: start a service, then classify libraries with it\n"
+        epilog += "\t$ PASTEClassifier.py -C PASTEClassifier.cfg -p -e local:16 -a PASTEClassifier.sock\n"
+        epilog += "\t$ PASTEClassifier.py -i consensus.fa -j PASTEClassifier.sock\n"
         parser = RepetOptionParser(description = description, epilog = epilog, usage = usage)
         parser.add_option("-i", "--fasta",        dest = "fastaFileName",         action = "store", type = "string",  help = "input fasta file name [compulsory] [format: fasta]", default = "")
         parser.add_option("-C", "--config",       dest = "configFileName",        action = "store", type = "string",  help = "configuration file name (e.g. PASTEClassifier.cfg) [compulsory]", default = "")
         parser.add_option("-D", "--decisionRules",dest = "decisionRulesFileName", action = "store", type = "string",  help = "classification rules file name (e.g. PASTEClassifierRules.yml) [optional]", default = "")
         parser.add_option("-S", "--step",         dest = "step",                  action = "store", type = "string",  help = "step (0/1/2): default: 0 for all steps", default = "0")
         parser.add_option("-p", "--parallel",     dest = "parallel",              action = "store_true",              help = "run tool in parallel", default = False)
+        parser.add_option("-e", "--executor",     dest = "executor",              action = "store", type = "string",  help = "parallel execution backend (launcher/local[:N]) [optional] [default: launcher]", default = "launcher")
+        parser.add_option("-s", "--staging",      dest = "staging",               action = "store", type = "string",  help = "batch staging in job directories (copy/link/offset) [optional] [default: copy]", default = "copy")
+        parser.add_option("-r", "--resume",       dest = "resume",                action = "store_true",              help = "resume a previous run, skipping the parts already done with the same inputs [optional] [default: False]", default = False)
+        parser.add_option("-k", "--cache",        dest = "cacheFileName",         action = "store", type = "string",  help = "per-sequence classification cache file, only classify sequences not found in it [optional]", default = "")
+        parser.add_option("-K", "--cacheSize",    dest = "cacheSize",             action = "store", type = "int",     help = "maximum number of sequences kept in the cache [optional] [default: 1000000]", default = 1000000)
+        parser.add_option("-l", "--pipeline",     dest = "pipeline",              action = "store_true",              help = "in parallel, chain STEP 1 and STEP 2 per batch instead of waiting for STEP 1 on all sequences [optional] [default: False]", default = False)
+        parser.add_option("-d", "--dynamic",      dest = "dynamic",               action = "store_true",              help = "with the local executor, cut the input into many small batches given to processes on demand [optional] [default: False]", default = False)
+        parser.add_option("-x", "--speculation",  dest = "speculativeFactor",     action = "store", type = "float",   help = "with dynamic batches, relaunch a batch running longer than this factor times the median batch time, 0 to disable [optional] [default: 3.0]", default = 3.0)
+        parser.add_option("-f", "--fusedPostProcess", dest = "fusedPostProcess",  action = "store_true",              help = "after redundancy removal, write the classif file from the fasta index instead of running GetClassifUniq [optional] [default: False]", default = False)
+        parser.add_option("-t", "--trace",        dest = "trace",                 action = "store_true",              help = "write a performance trace '<project>_trace.json' and '<project>_trace.chrome.json' [optional] [default: False]", default = False)
+        parser.add_option("-b", "--bankCache",    dest = "bankCacheDir",          action = "store", type = "string",  help = "directory of prepared banks shared by projects [optional]", default = "")
+        parser.add_option("-R", "--redundancyPrefilter", dest = "redundancyPrefilter", action = "store_true",      help = "remove redundancy only within groups of sequences sharing k-mers, in parallel [optional] [default: False]", default = False)
+        parser.add_option("-B", "--classifTableBackend", dest = "classifTableBackend", action = "store", type = "string", help = "database of the final '<project>_consensus_classif' table (mysql/sqlite), features, banks and Launcher jobs staying on the MySQL server [optional] [default: classif_table_backend of [classif_consensus], else mysql]", default = "")
+        parser.add_option("-a", "--serve",        dest = "serveAddress",          action = "store", type = "string",  help = "run as a service classifying the fasta files of requests, on a unix socket path or host:port [optional]", default = "")
+        parser.add_option("-j", "--submit",       dest = "submitAddress",         action = "store", type = "string",  help = "submit the fasta file to a service started with '-a', on a unix socket path or host:port [optional]", default = "")
         parser.add_option("-c", "--clean",        dest = "doClean",               action = "store_true",              help = "clean temporary files [optional] [default: False]", default = False)
         parser.add_option("-v", "--verbosity",    dest = "verbosity",             action = "store", type = "int",     help = "verbosity [optional] [default: 3, from 1 to 4]", default = 3)
         options = parser.parse_args()[0]
         self._setAttributesFromOptions(options)
 
     def _setAttributesFromOptions(self, options):
+        self._options = options
         self.setFastaFileName(options.fastaFileName)
         self.setConfigFileName(options.configFileName)
         self.setDecisionRulesFileName(options.decisionRulesFileName)
         self._steps = options.step
         self._parallel = options.parallel
+        self.setExecutor(options.executor)
+        self.setStaging(options.staging)
+        self.setResume(options.resume)
+        self.setCacheFileName(options.cacheFileName)
+        self._cacheSize = options.cacheSize
+        self.setPipeline(options.pipeline)
+        self.setDynamic(options.dynamic, options.speculativeFactor)
+        self.setFusedPostProcess(options.fusedPostProcess)
+        self.setTrace(options.trace)
+        self.setBankCacheDir(options.bankCacheDir)
+        self.setClassifTableBackend(options.classifTableBackend)
+        self.setRedundancyPrefilter(options.redundancyPrefilter)
+        self.setServeAddress(options.serveAddress)
+        self.setSubmitAddress(options.submitAddress)
         self.setDoClean(options.doClean)
         self.setVerbosity(options.verbosity)
 
@@ -131,6 +1152,13 @@ class PASTEClassifier(object):
         iConfigRules.addRuleOption(section = sectionName, option = "rev_complement", mandatory = True, type = "bool")
         iConfigRules.addRuleOption(section = sectionName, option = "add_wicker_code", mandatory = True, type = "bool")
         iConfigRules.addRuleOption(section = sectionName, option = "add_noCat_bestHitClassif", mandatory = True, type = "bool")
+        iConfigRules.addRuleOption(section = sectionName, option = "min_redundancy_identity", type = "float")
+        iConfigRules.addRuleOption(section = sectionName, option = "min_redundancy_coverage", type = "float")
+        iConfigRules.addRuleOption(section = sectionName, option = "classif_table_backend", type = "string")
+        for option in CLASSIF_CONSENSUS_OPTIONS:
+            iConfigRules.addRuleOption(section = sectionName, option = option, type = "string")
+        for option in DETECT_FEATURES_OPTIONS:
+            iConfigRules.addRuleOption(section = "detect_features", option = option, type = "string")
 
         if self._parallel:
             iConfigRules.addRuleOption(section = sectionName, option = "limit_job_nb", type = "int")
@@ -168,6 +1196,9 @@ class PASTEClassifier(object):
 
         self._classifFileName = "%s.classif" % self._projectName
 
+        if self._classifTableBackend == "" and self._iConfig.has_option(sectionName, "classif_table_backend"):
+            self.setClassifTableBackend(self._iConfig.get(sectionName, "classif_table_backend").lower())
+
     def setFastaFileName(self, fastaFileName):
         self._fastaFileName = fastaFileName
 
@@ -186,9 +1217,79 @@ class PASTEClassifier(object):
     def setDoClean(self, doClean):
         self._doClean = doClean
 
+    # # @param serveAddress string unix socket path or host:port the service listens on
+    #
+    def setServeAddress(self, serveAddress):
+        self._serveAddress = serveAddress
+
+    def setSubmitAddress(self, submitAddress):
+        self._submitAddress = submitAddress
+
+    def setRedundancyPrefilter(self, redundancyPrefilter):
+        self._redundancyPrefilter = redundancyPrefilter
+
     def setRmRdd(self, removeRedundancy):
         self. _removeRedundancy = removeRedundancy
 
+    # # Set the parallel execution backend.
+    #
+    # @param executor string 'launcher' (job table and scheduler), 'local' or 'local:N' (N local processes)
+    #
+    def setExecutor(self, executor):
+        lItems = executor.split(":")
+        self._executor = lItems[0]
+        self._nbLocalWorkers = 0
+        if len(lItems) > 1 and lItems[1] != "":
+            try:
+                self._nbLocalWorkers = int(lItems[1])
+            except ValueError:
+                self._logAndRaise("ERROR: wrong number of local processes in executor '%s'" % executor)
+
+    # # Set how batches reach the job directories.
+    #
+    # @param staging string 'copy' (copy in, copy out), 'link' (links to batch files) or 'offset' (read from the input fasta file by offset ranges, no batch file)
+    #
+    def setStaging(self, staging):
+        self._staging = staging
+
+    def setResume(self, resume):
+        self._resume = resume
+
+    def setCacheFileName(self, cacheFileName):
+        self._cacheFileName = cacheFileName
+
+    def setPipeline(self, pipeline):
+        self._pipeline = pipeline
+
+    # # Set the dynamic scheduling of batches on the local executor.
+    #
+    # @param speculativeFactor float a batch running longer than this factor times the median batch time is relaunched, 0 to disable
+    #
+    def setDynamic(self, dynamic, speculativeFactor = 3.0):
+        self._dynamic = dynamic
+        self._speculativeFactor = speculativeFactor
+
+    def setFusedPostProcess(self, fusedPostProcess):
+        self._fusedPostProcess = fusedPostProcess
+
+    def setTrace(self, trace):
+        self._trace = trace
+        if trace:
+            self._iTracer = RunTracer()
+        else:
+            self._iTracer = NullTracer()
+
+    def setBankCacheDir(self, bankCacheDir):
+        self._bankCacheDir = bankCacheDir
+
+    # # Set the database of the final classif table. DetectTEFeatures, LaunchPASTEC and the Launcher job table always
+    # use the MySQL server of [repet_env].
+    #
+    # @param classifTableBackend string 'mysql' (server of [repet_env]) or 'sqlite' (file '<project>_repet.sqlite')
+    #
+    def setClassifTableBackend(self, classifTableBackend):
+        self._classifTableBackend = classifTableBackend
+
     def setVerbosity(self, verbosity):
         self._verbosity = verbosity
 
@@ -196,20 +1297,36 @@ class PASTEClassifier(object):
         self._projectName = projectName
 
     def _checkOptions(self):
+        if self._executor not in ["launcher", "local"]:
+            self._logAndRaise("ERROR: unknown executor '%s' (must be 'launcher' or 'local[:N]')" % self._executor)
+        if self._executor == "local" and not self._parallel:
+            self._logAndRaise("ERROR: executor 'local' requires the parallel mode (option '-p')")
+        if self._pipeline and not self._parallel:
+            self._logAndRaise("ERROR: pipelined STEP 1 and STEP 2 requires the parallel mode (option '-p')")
+        if self._classifTableBackend == "":
+            self._classifTableBackend = "mysql"
+        if self._classifTableBackend not in ["mysql", "sqlite"]:
+            self._logAndRaise("ERROR: unknown classif table backend '%s' (must be 'mysql' or 'sqlite')" % self._classifTableBackend)
+        if self._dynamic and self._executor != "local":
+            self._logAndRaise("ERROR: dynamic batches require the executor 'local' (option '-e local[:N]')")
+        if self._staging not in ["copy", "link", "offset"]:
+            self._logAndRaise("ERROR: unknown staging '%s' (must be 'copy', 'link' or 'offset')" % self._staging)
         if self._fastaFileName == "":
             self._logAndRaise("ERROR: Missing input fasta file name")
         else:
             separator = "\n"
-            inGenomeFileHandler = open(self._fastaFileName, "r")
-            try:
-                CheckerUtils.checkHeaders(inGenomeFileHandler)
-            except CheckerException, e:
+            self._iFastaIndex = FastaIndex(self._fastaFileName)
+            if self._iFastaIndex.load():
+                self._log.debug("Fasta file indexed")
+            lWrongHeaders = self._iFastaIndex.getWrongHeaders()
+            if lWrongHeaders and self._isServiceJob:
+                # the client gets the message, the service goes on
+                self._logAndRaise("ERROR: wrong headers in file %s: %s (authorized characters are: a-z A-Z 0-9 - . : _)" % (self._fastaFileName, ", ".join(lWrongHeaders)))
+            if lWrongHeaders:
                 print "Error in file %s. Wrong headers are :" % self._fastaFileName
-                print separator.join(e.messages)
+                print separator.join(lWrongHeaders)
                 print "Authorized characters are : a-z A-Z 0-9 - . : _\n"
-                inGenomeFileHandler.close()
                 sys.exit(1)
-            inGenomeFileHandler.close()
 
 
     def _logAndRaise(self, errorMsg):
@@ -217,24 +1334,293 @@ class PASTEClassifier(object):
         raise Exception(errorMsg)
 
     def getPASTECcommand(self, iLauncher, fileName):
+        return iLauncher.getSystemCommand("LaunchPASTEC.py", self._getPASTECargs(fileName))
+
+    def _getPASTECargs(self, fileName, projectName = "", step = "2"):
+        if projectName == "":
+            projectName = self._projectName
         lArgs = []
         lArgs.append("-C %s" % self._configFileName)
-        if self._decisionRulesFileName:
+        if self._decisionRulesFileName and step == "2":
             lArgs.append("-D %s" % self._decisionRulesFileName)
-        lArgs.append("-P %s" % self._projectName)
-        lArgs.append("-S 2")
+        lArgs.append("-P %s" % projectName)
+        lArgs.append("-S %s" % step)
+        lArgs.append("-i %s" % fileName)
+        lArgs.append("-v %s" % self._verbosity)
+        return lArgs
+
+    def _getDetectTEFeaturesArgs(self, fileName, projectName):
+        lArgs = []
         lArgs.append("-i %s" % fileName)
+        lArgs.append("-P %s" % projectName)
+        lArgs.append("-C %s" % self._configFileName)
+        if self._doClean:
+            lArgs.append("-c")
         lArgs.append("-v %s" % self._verbosity)
-        return iLauncher.getSystemCommand("LaunchPASTEC.py", lArgs)
+        return lArgs
+
+    # # @return boolean True if STEP 1 and STEP 2 are chained per batch instead of separated by a barrier
+    #
+    def _isPipelined(self):
+        return self._pipeline and self._parallel and ("0" in self._steps or ("1" in self._steps and "2" in self._steps))
+
+    # # In pipelined mode, each batch is a sub-project so that its features do not collide with other batches. Its bank
+    # tables are views of the bank tables of the project, loaded once.
+    #
+    def _getBatchProjectName(self, count):
+        if self._isPipelined():
+            return "%s_b%i" % (self._projectName, count)
+        return self._projectName
+
+    # # @return list of (program, list of arguments) run by the job of a batch
+    #
+    def _getBatchPrograms(self, fileName, count):
+        projectName = self._getBatchProjectName(count)
+        lPrograms = []
+        if self._isPipelined():
+            lPrograms.append(("DetectTEFeatures.py", self._getDetectTEFeaturesArgs(fileName, projectName)))
+        lPrograms.append(("LaunchPASTEC.py", self._getPASTECargs(fileName, projectName, "2")))
+        return lPrograms
+
+    def _createLocalJobExecutor(self):
+        speculativeFactor = 0
+        if self._dynamic and not self._isPipelined():
+            speculativeFactor = self._speculativeFactor
+        return LocalJobExecutor(self._getNbLocalWorkers(), log = self._log, speculativeFactor = speculativeFactor)
+
+    def _getNbLocalWorkers(self):
+        nbWorkers = self._nbLocalWorkers
+        if nbWorkers <= 0:
+            nbWorkers = multiprocessing.cpu_count()
+        if self._maxJobNb > 0:
+            nbWorkers = min(nbWorkers, self._maxJobNb)
+        return nbWorkers
+
+    # # Make a file available in a job directory according to the staging mode.
+    #
+    # @param staging string 'copy' or 'link' (hard link, symbolic link if not possible)
+    #
+    def _stageFile(self, srcFileName, workDir, staging):
+        dstFileName = os.path.join(workDir, os.path.basename(srcFileName))
+        if staging == "copy":
+            shutil.copy(srcFileName, dstFileName)
+        else:
+            try:
+                os.link(srcFileName, dstFileName)
+            except OSError:
+                os.symlink(os.path.abspath(srcFileName), dstFileName)
+
+    # # Create the working directory of a batch job, with its batch and the config file, and the banks when the job
+    # runs DetectTEFeatures.
+    #
+    def _stageBatch(self, f, lRecords, workDir, cDir):
+        if os.path.exists(workDir):
+            shutil.rmtree(workDir)
+        os.makedirs(workDir)
+        if self._staging == "offset":
+            self._iFastaIndex.writeRecords(lRecords, os.path.join(workDir, f))
+        else:
+            self._stageFile("%s/batches/%s" % (cDir, f), workDir, self._staging)
+        self._stageFile("%s/%s" % (cDir, self._configFileName), workDir, self._staging)
+        if self._isPipelined():
+            self._linkBanks(workDir)
+
+    # # @return boolean True if batch results are appended to the final classif file without intermediate files
+    #
+    def _isStreamingBatchResults(self):
+        return self._executor == "local" and self._staging != "copy" and self._iManifest is None
+
+    def _getBatchKey(self, count, lRecords):
+        return self._iManifest.getKey([self._runKey, count, self._iFastaIndex.getRanges(lRecords)])
+
+    # # Remove batches already done in a resumed run, including Launcher batches whose result was written after the
+    # previous run stopped following them.
+    #
+    # @return list of (batch number, batch) to launch
+    #
+    def _getBatchesToLaunch(self, lBatches):
+        lBatchesToLaunch = []
+        count = 0
+        for batch in lBatches:
+            count += 1
+            if self._iManifest is not None:
+                batchKey = self._getBatchKey(count, batch[2])
+                if self._iManifest.isDone("STEP2_batch_%i" % count, batchKey) or self._iManifest.setDoneIfWritten("STEP2_batch_%i" % count, batchKey):
+                    continue
+            lBatchesToLaunch.append((count, batch))
+        if len(lBatchesToLaunch) < len(lBatches):
+            self._log.info("Skip %i batch(es) already done" % (len(lBatches) - len(lBatchesToLaunch)))
+        return lBatchesToLaunch
+
+    def _setBatchDone(self, count, lRecords):
+        if self._iManifest is not None:
+            self._iManifest.setDone("STEP2_batch_%i" % count, self._getBatchKey(count, lRecords), ["%s_%i" % (self._classifFileName, count)])
+
+    # # Record a batch about to be launched, removing the result of a previous launch.
+    #
+    def _setBatchLaunched(self, count, lRecords):
+        if self._iManifest is not None:
+            resultFileName = "%s_%i" % (self._classifFileName, count)
+            if os.path.exists(resultFileName):
+                os.remove(resultFileName)
+            self._iManifest.setLaunched("STEP2_batch_%i" % count, self._getBatchKey(count, lRecords), [resultFileName])
+
+    def _runBatchesLocally(self, lBatches, cDir, tmpDir):
+        classifFileName = self._classifFileName
+        lJobs = []
+        lWorkDirs = []
+        lResultFileNames = []
+        lStagingTimes = []
+        lStagedBatches = []
+        lCounts = []
+        for count, (f, cost, lRecords) in self._getBatchesToLaunch(lBatches):
+            lCounts.append(count)
+            jobName = "%s_PASTEC_%i" % (self._projectName, count)
+            workDir = os.path.join(tmpDir, jobName)
+            stagingStartTime = time.time()
+            self._stageBatch(f, lRecords, workDir, cDir)
+            lStagingTimes.append(time.time() - stagingStartTime)
+            lStagedBatches.append((f, lRecords))
+            cmd = " && ".join(["%s %s" % (prg, " ".join(lArgs)) for prg, lArgs in self._getBatchPrograms(f, count)])
+            lJobs.append((jobName, cmd, workDir))
+            lWorkDirs.append(workDir)
+            lResultFileNames.append("%s.classif" % self._getBatchProjectName(count))
+
+        # with zero-copy staging, results are appended to the final classif file in batch order as soon as available
+        dEndedJobs = {}
+        lNextJob = [0]
+        classifFile = None
+        if self._isStreamingBatchResults():
+            classifFile = open(classifFileName, "w")
+        def getResultFileName(index):
+            return os.path.join(iExecutor.getWorkDir(index), lResultFileNames[index])
+        def onJobEnd(index, jobName, status, elapsed):
+            dEndedJobs[index] = status
+            # each batch is recorded as soon as it ends, so that a run stopped later keeps it
+            if status == 0 and not self._isStreamingBatchResults():
+                count = lCounts[index]
+                shutil.move(getResultFileName(index), "%s/%s_%i" % (cDir, classifFileName, count))
+                self._setBatchDone(count, lBatches[count - 1][2])
+            while classifFile is not None and dEndedJobs.get(lNextJob[0]) == 0:
+                resultFile = open(getResultFileName(lNextJob[0]), "r")
+                for line in resultFile:
+                    classifFile.write(line)
+                resultFile.close()
+                lNextJob[0] += 1
+
+        # a speculative copy runs the same commands in its own directory, staged like the original one
+        def getSpeculativeJob(index):
+            jobName, cmd, workDir = lJobs[index]
+            self._stageBatch(lStagedBatches[index][0], lStagedBatches[index][1], "%s_spec" % workDir, cDir)
+            return "%s_spec" % jobName, cmd, "%s_spec" % workDir
+
+        if self._iExecutor is None:
+            self._iExecutor = self._createLocalJobExecutor()
+        iExecutor = self._iExecutor
+        self._log.info("Launch %i jobs on %i local processes" % (len(lJobs), self._getNbLocalWorkers()))
+        startTime = time.time()
+        lStatus = iExecutor.run(lJobs, onJobEnd, getSpeculativeJob)
+        makespan = time.time() - startTime
+        nbSpeculativeJobs, nbSpeculativeWins = iExecutor.getSpeculativeCounts()
+        if nbSpeculativeJobs:
+            self._log.info("Relaunched %i straggling job(s), %i copies finished first" % (nbSpeculativeJobs, nbSpeculativeWins))
+        if classifFile is not None:
+            classifFile.close()
+        for index in range(len(lStatus)):
+            jobName, status, elapsed = lStatus[index]
+            jobStartTime = iExecutor.getStartTime(index)
+            self._iTracer.addSpan(jobName, "batch", jobStartTime, elapsed, {"queueWait": jobStartTime - startTime, "execution": elapsed, "staging": lStagingTimes[index], "status": status}, lane = lCounts[index])
+
+        if lStatus:
+            lElapsed = sorted([elapsed for jobName, status, elapsed in lStatus])
+            self._log.info("Batches makespan: %.1fs (longest batch: %.1fs, median batch: %.1fs)" % (makespan, lElapsed[-1], lElapsed[len(lElapsed) / 2]))
+
+        for index in range(len(lStatus)):
+            count = lCounts[index]
+            workDir = lWorkDirs[index]
+            if lStatus[index][1] != 0:
+                continue
+            if self._doClean:
+                shutil.rmtree(workDir)
+                if os.path.exists("%s_spec" % workDir):
+                    shutil.rmtree("%s_spec" % workDir)
+
+        lFailedJobs = [jobName for jobName, status, elapsed in lStatus if status != 0]
+        if lFailedJobs:
+            self._logAndRaise("ERROR: %i job(s) failed, see logs in '%s': %s" % (len(lFailedJobs), tmpDir, ", ".join(lFailedJobs)))
+
+    # # Python statements run by a Launcher job to stage its batch, the config file and, when the job runs
+    # DetectTEFeatures, the banks in its working directory.
+    #
+    def _getLauncherStartCommands(self, f, lRecords, cDir):
+        lCmdStart = []
+        if self._staging == "offset":
+            lRanges = self._iFastaIndex.getRanges(lRecords)
+            lCmdStart.append("inFastaFile = open(\"%s\", \"r\")" % os.path.abspath(self._fastaFileName))
+            lCmdStart.append("outFastaFile = open(\"%s\", \"w\")" % f)
+            lCmdStart.append("[(inFastaFile.seek(offset), outFastaFile.write(inFastaFile.read(size))) for offset, size in %s]" % repr(lRanges))
+            lCmdStart.append("inFastaFile.close()")
+            lCmdStart.append("outFastaFile.close()")
+        elif self._staging == "link":
+            lCmdStart.append("os.symlink(\"%s/batches/%s\", \"%s\")" % (cDir, f, f))
+        else:
+            lCmdStart.append("shutil.copy(\"%s/batches/%s\", \".\")" % (cDir, f))
+        if self._staging == "copy":
+            lCmdStart.append("shutil.copy(\"%s/%s\", \".\")" % (cDir, self._configFileName))
+        else:
+            lCmdStart.append("os.symlink(\"%s/%s\", \"%s\")" % (cDir, self._configFileName, os.path.basename(self._configFileName)))
+        if self._isPipelined():
+            for fileName in self._getBankFilesToLink():
+                lCmdStart.append("os.symlink(\"%s\", \"%s\")" % (fileName, os.path.basename(fileName)))
+        return lCmdStart
+
+    # # @return string Python statement run by a Launcher job to append the current time to the times file of its batch
+    #
+    def _getLauncherTimeCommand(self, timesFileName):
+        return "open(\"%s\", \"a\").write(\"%%r\\n\" %% time.time())" % timesFileName
+
+    # # Add a span of the trace for each Launcher batch from the times written by its job on the node: job start,
+    # batch staged, result in place. The last three times are used if the job ran several times.
+    #
+    # @return list of the elapsed times of the batches
+    #
+    def _addLauncherBatchSpans(self, lBatchesToLaunch, cDir, submitTime):
+        lElapsed = []
+        for count, batch in lBatchesToLaunch:
+            timesFileName = "%s/%s_%i.times" % (cDir, self._classifFileName, count)
+            if not os.path.exists(timesFileName):
+                continue
+            timesFile = open(timesFileName, "r")
+            lTimes = [float(line) for line in timesFile if line.strip()]
+            timesFile.close()
+            os.remove(timesFileName)
+            if len(lTimes) < 3:
+                continue
+            jobStartTime, stagedTime, endTime = lTimes[-3:]
+            self._iTracer.addSpan("%s_PASTEC_%i" % (self._projectName, count), "batch", jobStartTime, endTime - jobStartTime, {"queueWait": jobStartTime - submitTime, "execution": endTime - stagedTime, "staging": stagedTime - jobStartTime, "status": 0}, lane = count)
+            lElapsed.append(endTime - jobStartTime)
+        return lElapsed
+
+    # # Run a tool, in a span of the trace.
+    #
+    def _runTraced(self, iTool, category):
+        iSpan = self._iTracer.start(iTool.__class__.__name__, category)
+        iTool.run()
+        iSpan.stop()
 
     def _classify(self):
         iLP = LaunchPASTEC(configFileName = self._configFileName, decisionRulesFileName = self._decisionRulesFileName, inputFileName = self._fastaFileName, projectName = self._projectName, verbose = self._verbosity)
-        iLP.run()
+        self._runTraced(iLP, "classification")
 
     def _classifyInParallel(self, nbSeq):
-        self._log.debug("Insert banks in database")
-        iLP = LaunchPASTEC(configFileName = self._configFileName, step = "1", inputFileName = self._fastaFileName, projectName = self._projectName, verbose = self._verbosity)
-        iLP.run()
+        if self._iBankCache is not None and self._iBankCache.isTableLoaded(self._getBankTableKey(), self._banksFingerprint) and not self._getMissingTables(self._getBankTableNames()):
+            self._log.info("Banks already inserted in database for project '%s', skipped" % self._projectName)
+        else:
+            self._log.debug("Insert banks in database")
+            iLP = LaunchPASTEC(configFileName = self._configFileName, step = "1", inputFileName = self._fastaFileName, projectName = self._projectName, verbose = self._verbosity)
+            self._runTraced(iLP, "classification")
+            if self._iBankCache is not None:
+                self._iBankCache.setTableLoaded(self._getBankTableKey(), self._banksFingerprint)
 
         self._log.info("Split fasta file")
         minSeqPerJob = 100
@@ -242,7 +1628,18 @@ class PASTEClassifier(object):
             nbSeqPerBatch = minSeqPerJob
         else:
             nbSeqPerBatch = nbSeq / self._maxJobNb + 1
-        FastaUtils.dbSplit(self._fastaFileName, nbSeqPerBatch, True, verbose = self._verbosity - 2)
+        nbBatches = (nbSeq + nbSeqPerBatch - 1) / nbSeqPerBatch
+        if self._dynamic:
+            # many small batches, so that processes ending early take the remaining ones
+            nbBatches = min(nbSeq, max(nbBatches, DYNAMIC_BATCHES_PER_PROCESS * self._getNbLocalWorkers()))
+        iSplitter = ResidueBalancedSplitter(self._iFastaIndex, nbBatches)
+        lBatches = iSplitter.split("batches", "batch_", doWrite = self._staging != "offset")
+        lCosts = [cost for batchFileName, cost, lRecords in lBatches]
+        if lCosts:
+            meanCost = float(sum(lCosts)) / len(lCosts)
+            self._log.info("Split into %i batches, expected cost per batch: max %i, mean %.0f (max/mean: %.2f)" % (len(lCosts), lCosts[0], meanCost, lCosts[0] / meanCost))
+        if self._isPipelined():
+            self._createBatchBankViews(len(lBatches))
 
         self._log.info("Launch PASTEC on each batch")
         queue = self._resources
@@ -252,102 +1649,606 @@ class PASTEClassifier(object):
         else:
             tmpDir = cDir
 
-        groupid = "%s_PASTEC" % self._projectName
-        acronym = "PASTEC"
-        iDb = DbFactory.createInstance()
-        iTJA = TableJobAdaptatorFactory.createInstance(iDb, "jobs")
-        iLauncher = Launcher(iTJA, cDir, tmpDir, queue, groupid)
-        lCmdsTuples = []
-        lFiles = FileUtils.getFileNamesList("%s/batches" % cDir, "batch_")
-        if len(lFiles) == 0:
-            self._logAndRaise("ERROR: directory 'batches' is empty")
+        # heaviest batches first, so that they do not end the run
+        if len(lBatches) == 0:
+            self._logAndRaise("ERROR: no batch to launch")
 
         classifFileName = self._classifFileName
 
-        count = 0
-        for f in lFiles:
-            count += 1
-            lCmds = [self.getPASTECcommand(iLauncher, f)]
-            lCmdStart = []
-            lCmdStart.append("shutil.copy(\"%s/batches/%s\", \".\")" % (cDir, f))
-            lCmdStart.append("shutil.copy(\"%s/%s\", \".\")" % (cDir, self._configFileName))
-            lCmdFinish = []
-            lCmdFinish.append("shutil.move(\"%s\", \"%s/%s_%i\")" % (classifFileName, cDir, classifFileName, count))
-            lCmdsTuples.append(iLauncher.prepareCommands_withoutIndentation(lCmds, lCmdStart, lCmdFinish))
-        iLauncher.runLauncherForMultipleJobs(acronym, lCmdsTuples, self._doClean)
+        if self._executor == "local":
+            self._runBatchesLocally(lBatches, cDir, tmpDir)
+        else:
+            groupid = "%s_PASTEC" % self._projectName
+            acronym = "PASTEC"
+            iSpan = self._iTracer.start("DbFactory.createInstance", "db")
+            iDb = DbFactory.createInstance()
+            iSpan.stop()
+            iTJA = TableJobAdaptatorFactory.createInstance(iDb, "jobs")
+            iLauncher = Launcher(iTJA, cDir, tmpDir, queue, groupid)
+            lCmdsTuples = []
+            lBatchesToLaunch = self._getBatchesToLaunch(lBatches)
+            for count, (f, cost, lRecords) in lBatchesToLaunch:
+                lCmds = [iLauncher.getSystemCommand(prg, lArgs) for prg, lArgs in self._getBatchPrograms(f, count)]
+                timesFileName = "%s/%s_%i.times" % (cDir, classifFileName, count)
+                if os.path.exists(timesFileName):
+                    os.remove(timesFileName)
+                lCmdStart = ["import time", self._getLauncherTimeCommand(timesFileName)] + self._getLauncherStartCommands(f, lRecords, cDir) + [self._getLauncherTimeCommand(timesFileName)]
+                # the result appears under its final name only once complete, a resumed run accepting it
+                lCmdFinish = []
+                lCmdFinish.append("shutil.move(\"%s.classif\", \"%s/%s_%i.tmp\")" % (self._getBatchProjectName(count), cDir, classifFileName, count))
+                lCmdFinish.append("os.rename(\"%s/%s_%i.tmp\", \"%s/%s_%i\")" % (cDir, classifFileName, count, cDir, classifFileName, count))
+                lCmdFinish.append(self._getLauncherTimeCommand(timesFileName))
+                lCmdsTuples.append(iLauncher.prepareCommands_withoutIndentation(lCmds, lCmdStart, lCmdFinish))
+                self._setBatchLaunched(count, lRecords)
+            startTime = time.time()
+            if lCmdsTuples:
+                iSpan = self._iTracer.start("Launcher.runLauncherForMultipleJobs", "batch", nbJobs = len(lCmdsTuples))
+                iLauncher.runLauncherForMultipleJobs(acronym, lCmdsTuples, self._doClean)
+                iSpan.stop()
+            makespan = time.time() - startTime
+            lElapsed = sorted(self._addLauncherBatchSpans(lBatchesToLaunch, cDir, startTime))
+            if lElapsed:
+                self._log.info("Batches makespan: %.1fs (longest batch: %.1fs, median batch: %.1fs)" % (makespan, lElapsed[-1], lElapsed[len(lElapsed) / 2]))
+            else:
+                self._log.info("Batches makespan: %.1fs" % makespan)
+            for count, (f, cost, lRecords) in lBatchesToLaunch:
+                self._setBatchDone(count, lRecords)
 
-        FileUtils.catFilesByPattern("%s_*" % classifFileName, classifFileName)
+        # merge in batch order, whatever the order in which batches ended
+        if not self._isStreamingBatchResults():
+            FileUtils.catFilesFromList(["%s_%i" % (classifFileName, count) for count in range(1, len(lBatches) + 1)], classifFileName, sort = False)
         if self._doClean:
             FileUtils.removeFilesByPattern("%s_*" % classifFileName)
-            shutil.rmtree("batches")
-
-    def _postProcessClassification(self):
-        self._log.info("Started post processing of Classification")
-        newFastaFileName = self._fastaFileName
-        newClassifFileName = self._classifFileName
-
-        if os.path.exists(newClassifFileName):
-            self._log.debug("Compute stats about classification on initial classif file")
-            iSP = StatPastec(inFileName = newClassifFileName)
-            iSP.run()
-
-            if self. _removeRedundancy:
+            if os.path.exists("batches"):
+                shutil.rmtree("batches")
+            if self._isPipelined():
+                self._dropBatchTables(len(lBatches))
+
+    # # Chain the post processing tools, each one reading and writing a whole fasta and classif files pair. With fused
+    # post processing, the classif file after redundancy removal is written from the fasta index instead of running
+    # GetClassifUniq.
+    #
+    # @return (fasta, classif) file names after post processing
+    #
+    def _runPostProcessingTools(self, newFastaFileName, newClassifFileName):
+        if self. _removeRedundancy:
+            withoutRddyFastaFileName = "%s_withoutRedundancy.fa" % self._projectName
+            withoutRddyClassifFileName = "%s.classif" % os.path.splitext(os.path.basename(withoutRddyFastaFileName))[0]
+            lInFileNames = [newFastaFileName, newClassifFileName, self._configFileName]
+            if self._isStageDone("removeRedundancy", lInFileNames):
+                self._log.info("Redundancy already removed, skipped")
+            else:
                 self._log.info("Removing redundancy")
-                withoutRddyFastaFileName = "%s_withoutRedundancy.fa" % self._projectName
-                iRemoveRedundancy = RemoveRedundancyBasedOnCI(newFastaFileName, newClassifFileName, self._configFileName, outFileName = withoutRddyFastaFileName, doClean = self._doClean, verbosity = self._verbosity)
-                iRemoveRedundancy.run()
+                self._removeRedundancyFrom(newFastaFileName, newClassifFileName, withoutRddyFastaFileName)
 
                 # Update classif file after redundancy removal
-                iGetClassifuniq = GetClassifUniq(withoutRddyFastaFileName, newClassifFileName, verbosity = self._verbosity)
-                iGetClassifuniq.run()
-                withoutRddyClassifFileName = "%s.classif" % os.path.splitext(os.path.basename(withoutRddyFastaFileName))[0]
-
-                # Gives stats on classification after redundancy removal
-                iSP = StatPastec(inFileName = withoutRddyClassifFileName)
-                iSP.run()
-                newFastaFileName = withoutRddyFastaFileName
-                newClassifFileName = withoutRddyClassifFileName
-
-            if self._reverseComp:
+                if self._fusedPostProcess:
+                    iGetClassifuniq = ClassifUniqFilter(withoutRddyFastaFileName, newClassifFileName, withoutRddyClassifFileName)
+                else:
+                    iGetClassifuniq = GetClassifUniq(withoutRddyFastaFileName, newClassifFileName, verbosity = self._verbosity)
+                self._runTraced(iGetClassifuniq, "postProcess")
+                self._setStageDone("removeRedundancy", lInFileNames, [withoutRddyFastaFileName, withoutRddyClassifFileName])
+
+            # Gives stats on classification after redundancy removal
+            iSP = StatPastec(inFileName = withoutRddyClassifFileName)
+            self._runTraced(iSP, "stats")
+            newFastaFileName = withoutRddyFastaFileName
+            newClassifFileName = withoutRddyClassifFileName
+
+        if self._reverseComp:
+            lInFileNames = [newFastaFileName, newClassifFileName]
+            outFastaFileName = "%s_negStrandReversed.fa" % os.path.splitext(newFastaFileName)[0]
+            outClassifFileName = "%s.classif" % os.path.splitext(outFastaFileName)[0]
+            if self._isStageDone("reverseComplement", lInFileNames):
+                self._log.info("Reverse complement already done, skipped")
+            else:
                 self._log.info("Reverse complement")
                 iRevComplAccording2Classif = ReverseComplementAccordingToClassif(fastaFile = newFastaFileName, classifFileName = newClassifFileName, isOutClassif = True)
-                iRevComplAccording2Classif.run()
+                self._runTraced(iRevComplAccording2Classif, "postProcess")
+                self._setStageDone("reverseComplement", lInFileNames, [outFastaFileName, outClassifFileName])
 
-                newFastaFileName = "%s_negStrandReversed.fa" % os.path.splitext(newFastaFileName)[0]
-                newClassifFileName = "%s.classif" % os.path.splitext(newFastaFileName)[0]
+            newFastaFileName = outFastaFileName
+            newClassifFileName = outClassifFileName
 
-            if self._addWickerCode:
+        return self._runRenamingTools(newFastaFileName, newClassifFileName)
+
+    # # Run the tools renaming headers with Wicker's code and classifying noCat sequences from their best hit.
+    #
+    # @return (fasta, classif) file names after these tools
+    #
+    def _runRenamingTools(self, newFastaFileName, newClassifFileName):
+        if self._addWickerCode:
+            lInFileNames = [newFastaFileName, newClassifFileName]
+            outFastaFileName = "%s_WickerH.fa" % os.path.splitext(newFastaFileName)[0]
+            outClassifFileName = "%s.classif" % os.path.splitext(outFastaFileName)[0]
+            if self._isStageDone("wickerCode", lInFileNames):
+                self._log.info("Headers already renamed according to Wicker's code, skipped")
+            else:
                 self._log.info("Rename headers according to Wicker's code")
                 projectNameInConfigFile = self._iConfig.get("project", "project_name")
                 iRHC = RenameHeaderClassif(classifFileName = newClassifFileName, fastaFileName = newFastaFileName, projectName = projectNameInConfigFile, isShorten = True, renameInClassif = True)
-                iRHC.run()
-
-                newFastaFileName = "%s_WickerH.fa" % os.path.splitext(newFastaFileName)[0]
-                newClassifFileName = "%s.classif" % os.path.splitext(newFastaFileName)[0]
-
-            if self._addNoCatBestHitClassif:
+                self._runTraced(iRHC, "postProcess")
+                self._setStageDone("wickerCode", lInFileNames, [outFastaFileName, outClassifFileName])
+
+            newFastaFileName = outFastaFileName
+            newClassifFileName = outClassifFileName
+
+        if self._addNoCatBestHitClassif:
+            lInFileNames = [newFastaFileName, newClassifFileName]
+            outFastaFileName = "%s_noCatBestHit.fa" % os.path.splitext(newFastaFileName)[0]
+            outClassifFileName = "%s.classif" % os.path.splitext(outFastaFileName)[0]
+            if self._isStageDone("noCatBestHit", lInFileNames):
+                self._log.info("noCat classification based on bestHit already added, skipped")
+            else:
                 self._log.info("Adding noCat classification based on bestHit")
                 iNCBHC = NoCatBestHitClassifier(fastaFileName = newFastaFileName, classifFileName = newClassifFileName)
-                iNCBHC.run()
+                self._runTraced(iNCBHC, "postProcess")
+                self._setStageDone("noCatBestHit", lInFileNames, [outFastaFileName, outClassifFileName])
 
-                newFastaFileName = "%s_noCatBestHit.fa" % os.path.splitext(newFastaFileName)[0]
-                newClassifFileName = "%s.classif" % os.path.splitext(newFastaFileName)[0]
+            newFastaFileName = outFastaFileName
+            newClassifFileName = outClassifFileName
 
-            self._log.debug("Compute stats about classification on final classif file (after all post processing)")
+        return newFastaFileName, newClassifFileName
+
+    # # Remove redundant sequences, within the components of the redundancy prefilter if asked for.
+    #
+    def _removeRedundancyFrom(self, fastaFileName, classifFileName, outFileName):
+        if not self._redundancyPrefilter or not self._removeRedundancyInComponents(fastaFileName, classifFileName, outFileName):
+            iRemoveRedundancy = RemoveRedundancyBasedOnCI(fastaFileName, classifFileName, self._configFileName, outFileName = outFileName, doClean = self._doClean, verbosity = self._verbosity)
+            self._runTraced(iRemoveRedundancy, "postProcess")
+
+    # # Run RemoveRedundancyBasedOnCI on each component of candidate redundant sequences, in parallel, sequences alone in
+    # their component being kept. The output fasta file keeps the input order.
+    #
+    # @return boolean False if the prefilter can not be used with these thresholds and sequences
+    #
+    def _removeRedundancyInComponents(self, fastaFileName, classifFileName, outFileName):
+        identity = self._iConfig.get("classif_consensus", "min_redundancy_identity")
+        coverage = self._iConfig.get("classif_consensus", "min_redundancy_coverage")
+        if identity is None or coverage is None:
+            self._log.warning("No min_redundancy_identity or min_redundancy_coverage in [classif_consensus], redundancy prefilter disabled")
+            return False
+        iFastaIndex = FastaIndex(fastaFileName)
+        iFastaIndex.load()
+        lRecords = iFastaIndex.getRecords()
+        if len(lRecords) < 2:
+            return False
+        nbProcesses = self._nbLocalWorkers
+        if nbProcesses <= 0:
+            nbProcesses = multiprocessing.cpu_count()
+        iPrefilter = RedundancyPrefilter(identity, coverage, nbProcesses)
+        minLength = min([record[3] for record in lRecords])
+        if not iPrefilter.setParameters(minLength):
+            self._log.warning("Exact match guaranteed by the redundancy thresholds on %i bp sequences is too short (%i bp), redundancy prefilter disabled" % (minLength, iPrefilter.getExactMatchLength(minLength)))
+            return False
+
+        iSpan = self._iTracer.start("RedundancyPrefilter.getComponents", "postProcess", nbSeq = len(lRecords))
+        lSequences = [sequence for record, sequence in iFastaIndex.iterSequences(lRecords)]
+        lComponents = iPrefilter.getComponents(lSequences)
+        del lSequences
+        iSpan.stop()
+        lMultiComponents = [lIndices for lIndices in lComponents if len(lIndices) > 1]
+        kmerSize, windowSize = iPrefilter.getParameters()
+        self._log.info("Redundancy prefilter (k=%i, w=%i): %i sequences alone, %i components of %i sequences" % (kmerSize, windowSize, len(lComponents) - len(lMultiComponents), len(lMultiComponents), sum([len(lIndices) for lIndices in lMultiComponents])))
+
+        sKeptHeaders = set([lRecords[lIndices[0]][0] for lIndices in lComponents if len(lIndices) == 1])
+        if lMultiComponents:
+            dHeader2ClassifLine = {}
+            classifFile = open(classifFileName, "r")
+            for line in classifFile:
+                dHeader2ClassifLine[line.split("\t", 1)[0]] = line
+            classifFile.close()
+            rddDir = os.path.abspath("%s_removeRedundancy" % self._projectName)
+            if os.path.exists(rddDir):
+                shutil.rmtree(rddDir)
+            lArgs = []
+            count = 0
+            for lIndices in lMultiComponents:
+                count += 1
+                workDir = os.path.join(rddDir, "component_%i" % count)
+                os.makedirs(workDir)
+                lComponentRecords = [lRecords[index] for index in lIndices]
+                iFastaIndex.writeRecords(lComponentRecords, os.path.join(workDir, "component.fa"))
+                componentClassifFile = open(os.path.join(workDir, "component.classif"), "w")
+                for record in lComponentRecords:
+                    componentClassifFile.write(dHeader2ClassifLine.get(record[0], ""))
+                componentClassifFile.close()
+                lArgs.append((workDir, "component.fa", "component.classif", os.path.abspath(self._configFileName), "component_withoutRedundancy.fa", self._doClean, self._verbosity))
+            iSpan = self._iTracer.start("RemoveRedundancyBasedOnCI", "postProcess", nbComponents = len(lArgs))
+            iPool = multiprocessing.Pool(min(nbProcesses, len(lArgs)))
+            try:
+                lOutFileNames = iPool.map(_removeRedundancyInDir, lArgs, 1)
+            finally:
+                iPool.terminate()
+                iPool.join()
+            iSpan.stop()
+            for workDir, outComponentFileName in zip([args[0] for args in lArgs], lOutFileNames):
+                componentFile = open(os.path.join(workDir, outComponentFileName), "r")
+                for line in componentFile:
+                    if line.startswith(">"):
+                        sKeptHeaders.add(line[1:].strip())
+                componentFile.close()
+            if self._doClean:
+                shutil.rmtree(rddDir)
+
+        outFile = open(outFileName, "w")
+        for record, sequence in iFastaIndex.iterSequences([record for record in lRecords if record[0] in sKeptHeaders]):
+            writeFastaRecord(outFile, record[0], sequence)
+        outFile.close()
+        self._log.info("Redundancy removed: %i sequences kept out of %i" % (len(sKeptHeaders), len(lRecords)))
+        return True
+
+    def _postProcessClassification(self):
+        self._log.info("Started post processing of Classification")
+        newFastaFileName = self._fastaFileName
+        newClassifFileName = self._classifFileName
+
+        if os.path.exists(newClassifFileName):
+            self._log.debug("Compute stats about classification on initial classif file")
             iSP = StatPastec(inFileName = newClassifFileName)
-            iSP.run()
+            self._runTraced(iSP, "stats")
+            newFastaFileName, newClassifFileName = self._runPostProcessingTools(newFastaFileName, newClassifFileName)
 
-            iDb = DbFactory.createInstance()
-            iDb.createTable("%s_consensus_classif" % self._projectName, "classif", newClassifFileName, True)
-            iDb.close()
+            self._log.debug("Compute stats about classification on final classif file (after all post processing)")
+            iSP = StatPastec(inFileName = newClassifFileName)
+            self._runTraced(iSP, "stats")
+
+            if self._classifTableBackend == "sqlite":
+                iSQLiteDb = self._openSQLiteDb()
+                iSpan = self._iTracer.start("createTable %s_consensus_classif" % self._projectName, "db")
+                nbRows = iSQLiteDb.createClassifTable("%s_consensus_classif" % self._projectName, newClassifFileName)
+                iSpan.stop()
+                iSQLiteDb.close()
+                self._log.info("Table '%s_consensus_classif' loaded with %i rows in '%s'" % (self._projectName, nbRows, self._getSQLiteDbFileName()))
+            else:
+                iSpan = self._iTracer.start("DbFactory.createInstance", "db")
+                iDb = DbFactory.createInstance()
+                iSpan.stop()
+                iSpan = self._iTracer.start("createTable %s_consensus_classif" % self._projectName, "db")
+                iDb.createTable("%s_consensus_classif" % self._projectName, "classif", newClassifFileName, True)
+                iSpan.stop()
+                iDb.close()
 
 #            shutil.move(newFastaFileName, "%s_denovoLibTEs.fa" % self._projectName)
+            if os.path.lexists("%s_denovoLibTEs.fa" % self._projectName):
+                os.remove("%s_denovoLibTEs.fa" % self._projectName)
             os.symlink(newFastaFileName, "%s_denovoLibTEs.fa" % self._projectName, )
+            self._outFastaFileName = newFastaFileName
+            self._outClassifFileName = newClassifFileName
 
         else:
             self._logAndRaise("No classification file found or generated")
         self._log.info("Finished post processing of Classification")
 
+    def _getSQLiteDbFileName(self):
+        return "%s_repet.sqlite" % self._projectName
+
+    def _openSQLiteDb(self):
+        iSQLiteDb = SQLiteDb(self._getSQLiteDbFileName())
+        iSQLiteDb.open()
+        return iSQLiteDb
+
+    def _isStageDone(self, stageName, lInFileNames):
+        return self._iManifest is not None and self._iManifest.isDone(stageName, self._iManifest.getKey([self._runKey, stageName], lInFileNames))
+
+    def _setStageDone(self, stageName, lInFileNames, lArtifacts):
+        if self._iManifest is not None:
+            self._iManifest.setDone(stageName, self._iManifest.getKey([self._runKey, stageName], lInFileNames), lArtifacts)
+
+    # # @return list of (option, file name) of the banks of [detect_features] found in the bank directory
+    #
+    def _getBankFileNames(self):
+        lBanks = []
+        for option in sorted(DETECT_FEATURES_BANKS.keys()):
+            if self._iConfig.has_option("detect_features", option) and self._iConfig.get("detect_features", option):
+                bankFileName = os.path.join(self._bankDir, self._iConfig.get("detect_features", option))
+                if os.path.isfile(bankFileName):
+                    lBanks.append((option, bankFileName))
+        return lBanks
+
+    # # @return string directory of the bank cache, '' if none. Pipelined batches run DetectTEFeatures in their own
+    # directory, so without a shared bank cache the banks are prepared once in a bank cache of the project.
+    #
+    def _getBankCacheDir(self):
+        if self._bankCacheDir == "" and self._isPipelined() and self._getBankFileNames():
+            return "%s_bankCache" % self._projectName
+        return self._bankCacheDir
+
+    # # Prepare the banks of [detect_features] in the bank cache and link them in the project directory.
+    #
+    def _prepareBanks(self):
+        blast = "blastplus"
+        if self._iConfig.has_option("detect_features", "blast"):
+            blast = self._iConfig.get("detect_features", "blast")
+        if self._iBankCache is None:
+            self._iBankCache = BankCache(self._getBankCacheDir(), blast, self._log)
+        lFingerprints = []
+        for option, bankFileName in self._getBankFileNames():
+            iSpan = self._iTracer.start("BankCache.prepare %s" % option, "banks")
+            entryDir = self._iBankCache.prepare(bankFileName, DETECT_FEATURES_BANKS[option])
+            iSpan.stop()
+            self._iBankCache.link(entryDir)
+            lFingerprints.append("%s=%s" % (option, os.path.basename(entryDir)))
+        self._banksFingerprint = hashlib.md5("\n".join(lFingerprints)).hexdigest()
+        self._log.info("%i bank(s) ready from the bank cache" % len(lFingerprints))
+
+    def _getBankTableKey(self):
+        return "%s/%s/%s" % (os.environ.get("REPET_HOST", ""), os.environ.get("REPET_DB", ""), self._projectName)
+
+    # # @return list of the feature tables written by DetectTEFeatures for a project
+    #
+    def _getFeatureTableNames(self, projectName = ""):
+        if projectName == "":
+            projectName = self._projectName
+        lTableNames = []
+        for option in sorted(DETECT_FEATURES_TABLES.keys()):
+            if self._iConfig.has_option("detect_features", option) and self._iConfig.get("detect_features", option).lower() == "yes":
+                lTableNames.append("%s_%s" % (projectName, DETECT_FEATURES_TABLES[option]))
+        return lTableNames
+
+    # # @return list of the bank tables loaded by LaunchPASTEC STEP 1 for a project
+    #
+    def _getBankTableNames(self, projectName = ""):
+        if projectName == "":
+            projectName = self._projectName
+        return ["%s_%s" % (projectName, PASTEC_BANK_TABLES[option]) for option, bankFileName in self._getBankFileNames() if option in PASTEC_BANK_TABLES]
+
+    # # Give each batch sub-project the bank tables of the project, as views.
+    #
+    def _createBatchBankViews(self, nbBatches):
+        lBankTableNames = self._getBankTableNames()
+        if not lBankTableNames:
+            return
+        iDb = DbFactory.createInstance()
+        for count in range(1, nbBatches + 1):
+            for tableName, batchTableName in zip(lBankTableNames, self._getBankTableNames(self._getBatchProjectName(count))):
+                iDb.execute("DROP VIEW IF EXISTS %s" % batchTableName)
+                iDb.execute("CREATE VIEW %s AS SELECT * FROM %s" % (batchTableName, tableName))
+        iDb.close()
+
+    # # Drop the feature tables and bank views of the batch sub-projects.
+    #
+    def _dropBatchTables(self, nbBatches):
+        iDb = DbFactory.createInstance()
+        for count in range(1, nbBatches + 1):
+            batchProjectName = self._getBatchProjectName(count)
+            for tableName in self._getBankTableNames(batchProjectName):
+                iDb.execute("DROP VIEW IF EXISTS %s" % tableName)
+            for tableName in self._getFeatureTableNames(batchProjectName):
+                iDb.dropTable(tableName)
+        iDb.close()
+        self._log.debug("Tables of %i batch sub-projects dropped" % nbBatches)
+
+    # # @return list of the tables not found in the database of [repet_env]
+    #
+    def _getMissingTables(self, lTableNames):
+        iSpan = self._iTracer.start("DbFactory.createInstance", "db")
+        iDb = DbFactory.createInstance()
+        iSpan.stop()
+        lMissingTableNames = [tableName for tableName in lTableNames if not iDb.doesTableExist(tableName)]
+        iDb.close()
+        return lMissingTableNames
+
+    # # Load the manifest of a resumed run, the run key depending on the content of the fasta, config and decision rules files.
+    #
+    def _loadManifest(self):
+        self._iManifest = RunManifest("%s_PASTEClassifier.manifest" % self._projectName)
+        self._iManifest.load()
+        self._runKey = self._iManifest.getKey([self._parallel, self._isPipelined()], [self._fastaFileName, self._configFileName, self._decisionRulesFileName])
+        self._log.info("Resume run (key: %s)" % self._runKey)
+
+    # # @return string fingerprint of everything except the sequence that changes a classif line: STEP 1 settings,
+    # content of the banks, classification settings of STEP 2 and decision rules
+    #
+    def _getClassifSettingsFingerprint(self):
+        lItems = []
+        for sectionName, lOptions in [("detect_features", DETECT_FEATURES_OPTIONS), ("classif_consensus", CLASSIF_CONSENSUS_OPTIONS)]:
+            for option in lOptions:
+                if self._iConfig.has_option(sectionName, option):
+                    lItems.append("%s:%s=%s" % (sectionName, option, self._iConfig.get(sectionName, option)))
+        for option, bankFileName in self._getBankFileNames():
+            if self._iBankCache is not None:
+                lItems.append("%s:%s" % (option, self._iBankCache.getFingerprint(bankFileName)))
+            else:
+                lItems.append("%s:%s" % (option, getFileMd5(bankFileName)))
+        if self._decisionRulesFileName:
+            lItems.append(open(self._decisionRulesFileName, "r").read())
+        return hashlib.sha1("\n".join(lItems)).hexdigest()
+
+    # # Look up every input sequence in the cache and switch the input to the sequences not found. A service job uses
+    # the cache opened by the service.
+    #
+    # @return dict cached classif line without sequence name for each sequence header found in the cache
+    #
+    def _getClassifFromCache(self):
+        if self._iClassifCache is None:
+            self._iClassifCache = ClassifCache(self._cacheFileName, self._getClassifSettingsFingerprint(), self._cacheSize)
+            self._iClassifCache.open()
+        self._dHeader2CacheKey = {}
+        for record, sequence in self._iFastaIndex.iterSequences(self._iFastaIndex.getRecords()):
+            self._dHeader2CacheKey[record[0]] = self._iClassifCache.getKey(sequence)
+        dKey2Classif = self._iClassifCache.get(self._dHeader2CacheKey.values())
+        dHeader2Classif = dict([(header, dKey2Classif[key]) for header, key in self._dHeader2CacheKey.items() if key in dKey2Classif])
+        self._log.info("Classification cache: %i hit(s), %i miss(es)" % (len(dHeader2Classif), len(self._dHeader2CacheKey) - len(dHeader2Classif)))
+
+        lMissRecords = [record for record in self._iFastaIndex.getRecords() if record[0] not in dHeader2Classif]
+        if lMissRecords:
+            missFastaFileName = "%s_cacheMisses.fa" % self._projectName
+            self._iFastaIndex.writeRecords(lMissRecords, missFastaFileName)
+            self._lInputFasta = (self._fastaFileName, self._iFastaIndex)
+            self._fastaFileName = missFastaFileName
+            self._iFastaIndex = FastaIndex(missFastaFileName)
+            self._iFastaIndex.load()
+        return dHeader2Classif
+
+    # # Restore the input fasta file, store the new classif lines in the cache and merge them with the cached ones in input order.
+    #
+    def _mergeClassifWithCache(self, dHeader2Classif):
+        dNewClassif = {}
+        if self._lInputFasta:
+            if self._doClean:
+                os.remove(self._fastaFileName)
+                os.remove("%s.pcidx" % self._fastaFileName)
+            self._fastaFileName, self._iFastaIndex = self._lInputFasta
+            self._lInputFasta = None
+            classifFile = open(self._classifFileName, "r")
+            for line in classifFile:
+                lColumns = line.rstrip("\n").split("\t", 1)
+                if len(lColumns) == 2 and lColumns[0] in self._dHeader2CacheKey:
+                    dHeader2Classif[lColumns[0]] = lColumns[1]
+                    dNewClassif[self._dHeader2CacheKey[lColumns[0]]] = lColumns[1]
+            classifFile.close()
+            self._iClassifCache.put(dNewClassif)
+        if not self._isServiceJob:
+            self._iClassifCache.close()
+            self._iClassifCache = None
+
+        tmpClassifFileName = "%s.tmp" % self._classifFileName
+        classifFile = open(tmpClassifFileName, "w")
+        for record in self._iFastaIndex.getRecords():
+            if record[0] in dHeader2Classif:
+                classifFile.write("%s\t%s\n" % (record[0], dHeader2Classif[record[0]]))
+        classifFile.close()
+        os.rename(tmpClassifFileName, self._classifFileName)
+
+    # # @return (socket family, address) of a unix socket path or host:port
+    #
+    def _getSocketAddress(self, address):
+        host, separator, port = address.rpartition(":")
+        if separator and port.isdigit():
+            return socket.AF_INET, (host or "localhost", int(port))
+        return socket.AF_UNIX, address
+
+    # # @return list of the absolute paths of the banks of [detect_features] and of their index files
+    #
+    def _getBankFilesToLink(self):
+        lFileNames = []
+        for option, bankFileName in self._getBankFileNames():
+            lFileNames.extend([os.path.abspath(fileName) for fileName in sorted(glob.glob("%s*" % bankFileName))])
+        return lFileNames
+
+    # # Link the banks of [detect_features] and their index files in a job directory.
+    #
+    def _linkBanks(self, jobDir):
+        for fileName in self._getBankFilesToLink():
+            os.symlink(fileName, os.path.join(jobDir, os.path.basename(fileName)))
+
+    # # Classify the fasta file of a request in its own directory, with the options, checked config, classification
+    # cache, bank cache and local executor of the service.
+    #
+    # @param dRequest dict with key 'fasta', absolute path of the fasta file to classify
+    # @return dict result: 'status', and 'jobDir', 'fasta', 'classif' (absolute paths) or 'message'
+    #
+    def _runJob(self, dRequest, jobDir):
+        fastaFileName = dRequest.get("fasta", "")
+        if not os.path.isabs(fastaFileName) or not os.path.isfile(fastaFileName):
+            return {"status": "error", "message": "no fasta file '%s' (absolute path expected)" % fastaFileName}
+        os.makedirs(jobDir)
+        self._stageFile(fastaFileName, jobDir, "link")
+        self._stageFile(self._configFileName, jobDir, "copy")
+        if not self._bankCacheDir:
+            self._linkBanks(jobDir)
+        options = copy.copy(self._options)
+        options.fastaFileName = os.path.basename(fastaFileName)
+        options.configFileName = os.path.basename(self._configFileName)
+        options.serveAddress = ""
+        iJobClassifier = PASTEClassifier()
+        iJobClassifier._setAttributesFromOptions(options)
+        iJobClassifier._isServiceJob = True
+        iJobClassifier._iConfig = self._iConfig
+        iJobClassifier._bankDir = self._bankDir
+        iJobClassifier._iBankCache = self._iBankCache
+        iJobClassifier._iClassifCache = self._iClassifCache
+        iJobClassifier._iExecutor = self._iExecutor
+        startTime = time.time()
+        serveDir = os.getcwd()
+        os.chdir(jobDir)
+        try:
+            iJobClassifier.run()
+        except (Exception, SystemExit), e:
+            self._log.error("Job in '%s' failed: %s" % (jobDir, e))
+            return {"status": "error", "jobDir": jobDir, "message": str(e)}
+        finally:
+            os.chdir(serveDir)
+            self._iBankCache = iJobClassifier._iBankCache
+        dResult = {"status": "ok", "jobDir": jobDir, "elapsed": time.time() - startTime, "fasta": "", "classif": ""}
+        if iJobClassifier._outClassifFileName:
+            dResult["fasta"] = os.path.join(jobDir, iJobClassifier._outFastaFileName)
+            dResult["classif"] = os.path.join(jobDir, iJobClassifier._outClassifFileName)
+        return dResult
+
+    # # Serve classification requests, one job at a time in the order they were received. The config is checked and
+    # the environment set once, the classification cache stays open and the bank cache and local executor are shared
+    # from one job to the next.
+    #
+    def _serve(self):
+        if self._options is None:
+            self._logAndRaise("ERROR: the service takes its options from the command line")
+        self._bankDir = os.getcwd()
+        if self._cacheFileName:
+            self._iClassifCache = ClassifCache(self._cacheFileName, self._getClassifSettingsFingerprint(), self._cacheSize)
+            self._iClassifCache.open()
+        if self._parallel and self._executor == "local":
+            self._iExecutor = self._createLocalJobExecutor()
+        for option in ["decisionRulesFileName", "cacheFileName", "bankCacheDir"]:
+            if getattr(self._options, option):
+                setattr(self._options, option, os.path.abspath(getattr(self._options, option)))
+        self._configFileName = os.path.abspath(self._configFileName)
+        family, address = self._getSocketAddress(self._serveAddress)
+        if family == socket.AF_UNIX:
+            if os.path.exists(address):
+                os.remove(address)
+            iServer = ThreadingUnixServer(address, ClassificationRequestHandler)
+        else:
+            iServer = ThreadingTCPServer(address, ClassificationRequestHandler)
+        iServer.qJobs = Queue.Queue()
+        iServerThread = threading.Thread(target = iServer.serve_forever)
+        iServerThread.daemon = True
+        iServerThread.start()
+        self._log.info("Serving classification requests on '%s'" % self._serveAddress)
+        # SIGTERM stops the service like Ctrl-C, so that the socket is removed
+        def stop(signum, frame):
+            raise KeyboardInterrupt()
+        previousHandler = signal.signal(signal.SIGTERM, stop)
+        count = 0
+        try:
+            while True:
+                try:
+                    dRequest, qResult = iServer.qJobs.get(True, 1)
+                except Queue.Empty:
+                    continue
+                count += 1
+                jobDir = os.path.join(self._bankDir, "%s_job%i_%s" % (self._projectName, count, time.strftime("%Y%m%d%H%M%S")))
+                self._log.info("Job %i: '%s' in '%s' (%i waiting)" % (count, dRequest.get("fasta", ""), jobDir, iServer.qJobs.qsize()))
+                qResult.put(self._runJob(dRequest, jobDir))
+        except KeyboardInterrupt:
+            self._log.info("Service stopped")
+        finally:
+            signal.signal(signal.SIGTERM, previousHandler)
+            iServer.shutdown()
+            iServer.server_close()
+            if self._iClassifCache is not None:
+                self._iClassifCache.close()
+            if family == socket.AF_UNIX and os.path.exists(address):
+                os.remove(address)
+
+    # # Send the fasta file to a service and wait for its classification.
+    #
+    def _submit(self):
+        if self._fastaFileName == "":
+            self._logAndRaise("ERROR: Missing input fasta file name")
+        family, address = self._getSocketAddress(self._submitAddress)
+        iSocket = socket.socket(family, socket.SOCK_STREAM)
+        iSocket.connect(address)
+        iSocket.sendall("%s\n" % json.dumps({"fasta": os.path.abspath(self._fastaFileName)}))
+        responseFile = iSocket.makefile("r")
+        dResult = json.loads(responseFile.readline())
+        responseFile.close()
+        iSocket.close()
+        if dResult["status"] != "ok":
+            self._logAndRaise("ERROR: classification failed: %s" % dResult["message"])
+        self._log.info("Classified in %.1fs: fasta '%s', classif '%s'" % (dResult["elapsed"], dResult["fasta"], dResult["classif"]))
+
     # # Setup the required environment.
     #
     # @param config ConfigParser instance
@@ -360,44 +2261,100 @@ class PASTEClassifier(object):
         os.environ["REPET_PORT"] = self._iConfig.get("repet_env", "repet_port")
         os.environ["REPET_JOB_MANAGER"] = self._iConfig.get("repet_env", "repet_job_manager")
         os.environ["REPET_QUEUE"] = self._iConfig.get("repet_env", "repet_job_manager")
+        # whatever the classif table backend, DetectTEFeatures, LaunchPASTEC and the Launcher job table use MySQL
         os.environ["REPET_JOBS"] = "MySQL"
 
     def run(self):
         LoggerFactory.setLevel(self._log, self._verbosity)
-        if self._configFileName:
+        if self._submitAddress:
+            self._submit()
+            return
+        # a service job gets the config checked and the environment set by the service
+        if self._isServiceJob:
+            self._setAttributesFromConfig()
+        elif self._configFileName:
             self._checkConfig()
+        if self._serveAddress:
+            self._setup_env()
+            self._serve()
+            return
         self._checkOptions()
-        self._setup_env()
+        if not self._isServiceJob:
+            self._setup_env()
 
         toolName = "PASTEClassifier"
         if self._parallel:
             toolName = "PASTEClassifier parallelized"
 
         self._log.info("START %s" % toolName)
+        iRunSpan = self._iTracer.start("PASTEClassifier.run", "run", fastaFileName = self._fastaFileName)
         self._log.info("Fasta file name: %s" % self._fastaFileName)
-        nbSeq = FastaUtils.dbSize(self._fastaFileName)
+        nbSeq = self._iFastaIndex.getNbSeq()
         self._log.debug("Total number of sequences: %i" % nbSeq)
-
-        if "1" in self._steps or "0" in self._steps:
-            self._log.info("Running STEP 1 of %s: DetectTEFeatures" % toolName)
-            if self._parallel:
-                iDF = DetectTEFeatures_parallelized(self._fastaFileName, self._projectName, self._configFileName, self._doClean, self._verbosity)
-                iDF.run()
+        if self._resume:
+            self._loadManifest()
+        if self._getBankCacheDir():
+            self._prepareBanks()
+
+        dHeader2Classif = None
+        isClassifNeeded = True
+        if self._cacheFileName:
+            if "0" in self._steps or ("1" in self._steps and "2" in self._steps):
+                dHeader2Classif = self._getClassifFromCache()
+                isClassifNeeded = self._lInputFasta is not None
+                nbSeq = self._iFastaIndex.getNbSeq()
+            else:
+                self._log.warning("Classification cache is only used when running STEP 1 and STEP 2, ignored")
+
+        if self._isPipelined():
+            self._log.info("STEP 1 of %s pipelined with STEP 2 on each batch" % toolName)
+        elif isClassifNeeded and ("1" in self._steps or "0" in self._steps):
+            lMissingTableNames = []
+            if self._isStageDone("STEP1", []):
+                lMissingTableNames = self._getMissingTables(self._getFeatureTableNames())
+                if lMissingTableNames:
+                    self._log.info("STEP 1 of %s already done but table(s) %s missing, run again" % (toolName, ", ".join(lMissingTableNames)))
+            if self._isStageDone("STEP1", []) and not lMissingTableNames:
+                self._log.info("STEP 1 of %s already done, skipped" % toolName)
             else:
-                iDF = DetectTEFeatures(self._fastaFileName, self._projectName, self._configFileName, self._doClean, self._verbosity)
-                iDF.run()
-            self._log.info("Finished STEP 1 of %s: DetectTEFeatures" % toolName)
+                self._log.info("Running STEP 1 of %s: DetectTEFeatures" % toolName)
+                iSpan = self._iTracer.start("STEP 1", "STEP1")
+                if self._parallel:
+                    iDF = DetectTEFeatures_parallelized(self._fastaFileName, self._projectName, self._configFileName, self._doClean, self._verbosity)
+                    self._runTraced(iDF, "STEP1")
+                else:
+                    iDF = DetectTEFeatures(self._fastaFileName, self._projectName, self._configFileName, self._doClean, self._verbosity)
+                    self._runTraced(iDF, "STEP1")
+                iSpan.stop()
+                self._setStageDone("STEP1", [], [])
+                self._log.info("Finished STEP 1 of %s: DetectTEFeatures" % toolName)
 
         if "2" in self._steps or "0" in self._steps:
             self._log.info("Running STEP 2 of %s: Classification" % toolName)
-            if self._parallel:
-                self._classifyInParallel(nbSeq)
+            if not isClassifNeeded:
+                self._log.info("All sequences found in the classification cache")
+            elif self._isStageDone("STEP2", []):
+                self._log.info("Classification already done, skipped")
             else:
-                self._classify()
+                iSpan = self._iTracer.start("STEP 2", "classification", nbSeq = nbSeq)
+                if self._parallel:
+                    self._classifyInParallel(nbSeq)
+                else:
+                    self._classify()
+                iSpan.stop()
+                self._setStageDone("STEP2", [], [self._classifFileName])
+            if dHeader2Classif is not None:
+                self._mergeClassifWithCache(dHeader2Classif)
+            iSpan = self._iTracer.start("post processing", "postProcess")
             self._postProcessClassification()
+            iSpan.stop()
 
             self._log.info("Finished STEP 2 of %s: Classification" % toolName)
 
+        iRunSpan.stop()
+        if self._trace:
+            self._iTracer.write("%s_trace.json" % self._projectName, "%s_trace.chrome.json" % self._projectName)
+            self._log.info("Performance trace written in '%s_trace.json' and '%s_trace.chrome.json'" % (self._projectName, self._projectName))
         self._log.info("END %s" % toolName)
 
 if __name__ == "__main__":
@@ -0,0 +1,936 @@
+#!/usr/bin/env python
+
+# Copyright INRA (Institut National de la Recherche Agronomique)
+# http://www.inra.fr
+# http://urgi.versailles.inra.fr
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and,  more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+import os
+import sys
+import glob
+import json
+import time
+import random
+import filecmp
+import shutil
+import string
+import subprocess
+from optparse import OptionParser
+
+# Stand-ins of the REPET commons modules used by PASTEClassifier.py. They are deterministic, need no BLAST, HMMER,
+# MySQL nor SGE, and spend CPU time in proportion to sequence length to mimic the real tools.
+STANDIN_COMMON = '''
+import os
+import hashlib
+
+WORK_FACTOR = int(os.environ.get("PASTEC_BENCH_WORK", "1"))
+
+def readFasta(fastaFileName):
+    lRecords = []
+    header = None
+    lLines = []
+    for line in open(fastaFileName, "r"):
+        line = line.strip()
+        if line.startswith(">"):
+            if header is not None:
+                lRecords.append((header, "".join(lLines)))
+            header = line[1:]
+            lLines = []
+        elif line:
+            lLines.append(line)
+    if header is not None:
+        lRecords.append((header, "".join(lLines)))
+    return lRecords
+
+def writeFasta(lRecords, fastaFileName):
+    outFile = open(fastaFileName, "w")
+    for header, sequence in lRecords:
+        outFile.write(">%s\\n" % header)
+        for i in range(0, len(sequence), 60):
+            outFile.write("%s\\n" % sequence[i:i + 60])
+    outFile.close()
+
+def readClassif(classifFileName):
+    return [line.rstrip("\\n").split("\\t") for line in open(classifFileName, "r") if line.strip()]
+
+def writeClassif(lClassif, classifFileName):
+    outFile = open(classifFileName, "w")
+    for lColumns in lClassif:
+        outFile.write("%s\\n" % "\\t".join(lColumns))
+    outFile.close()
+
+def work(sequence):
+    digest = ""
+    for i in range(WORK_FACTOR):
+        digest = hashlib.md5(digest + sequence).hexdigest()
+    return digest
+
+ORDERS = [("I", "LTR", "Gypsy"), ("I", "LINE", "L1"), ("I", "SINE", "Alu"), ("II", "TIR", "hAT"), ("II", "Helitron", "Helitron"), ("II", "MITE", "MITE"), ("noCat", "noCat", "")]
+
+def classify(header, sequence):
+    digest = work(sequence)
+    value = int(digest[:8], 16)
+    classif, order, superfamily = ORDERS[value % len(ORDERS)]
+    strand = "+-"[(value >> 4) % 2]
+    status = ["ok", "ok", "ok", "PotentialChimeric"][(value >> 5) % 4]
+    completeness = ["complete", "incomplete", "NA"][(value >> 7) % 3]
+    hitClass, hitOrder, hitSuperfamily = ORDERS[(value >> 9) % (len(ORDERS) - 1)]
+    evidence = "CI=%i; coding=(TE_BLRtx: %s-1_XX:Class%s:%s:%s: %.2f%%); struct=(TElength: %ibps); other=(NA)" % (value % 100, hitSuperfamily, hitClass, hitOrder, hitSuperfamily, (value >> 12) % 10000 / 100.0, len(sequence))
+    return [header, str(len(sequence)), strand, status, classif, order, completeness, evidence]
+
+BANK_INDEX_SUFFIXES = {"nucl": [".nhr", ".nin", ".nsq"], "prot": [".phr", ".pin", ".psq"]}
+
+def formatBank(bankFileName, dbType):
+    digest = work(open(bankFileName, "r").read())
+    for suffix in BANK_INDEX_SUFFIXES[dbType]:
+        outFile = open("%s%s" % (bankFileName, suffix), "w")
+        outFile.write("%s\\n" % digest)
+        outFile.close()
+'''
+
+STANDIN_MODULES = {
+"commons/core/LoggerFactory.py": '''
+import sys
+import logging
+
+class LoggerFactory(object):
+
+    @staticmethod
+    def createLogger(name, verbosity = 2):
+        log = logging.getLogger(name)
+        if not log.handlers:
+            handler = logging.StreamHandler(sys.stdout)
+            handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+            log.addHandler(handler)
+        LoggerFactory.setLevel(log, verbosity)
+        return log
+
+    @staticmethod
+    def setLevel(log, verbosity):
+        log.setLevel({0: logging.ERROR, 1: logging.WARNING, 2: logging.INFO}.get(verbosity, logging.DEBUG))
+''',
+"commons/core/utils/FileUtils.py": '''
+import os
+import glob
+
+class FileUtils(object):
+
+    @staticmethod
+    def getFileNamesList(dirName, patternFileFilter = ".*"):
+        return sorted([fileName for fileName in os.listdir(dirName) if patternFileFilter in fileName])
+
+    @staticmethod
+    def catFilesByPattern(pattern, outFileName):
+        outFile = open(outFileName, "w")
+        for fileName in sorted(glob.glob(pattern)):
+            outFile.write(open(fileName, "r").read())
+        outFile.close()
+
+    @staticmethod
+    def catFilesFromList(lFileNames, outFileName, sort = True):
+        if sort:
+            lFileNames = sorted(lFileNames)
+        outFile = open(outFileName, "w")
+        for fileName in lFileNames:
+            outFile.write(open(fileName, "r").read())
+        outFile.close()
+
+    @staticmethod
+    def removeFilesByPattern(pattern):
+        for fileName in glob.glob(pattern):
+            os.remove(fileName)
+''',
+"commons/core/utils/RepetOptionParser.py": '''
+from optparse import OptionParser
+
+class RepetOptionParser(OptionParser):
+    pass
+''',
+"commons/core/checker/CheckerException.py": '''
+class CheckerException(Exception):
+
+    def __init__(self, msg = ""):
+        Exception.__init__(self, msg)
+        self.messages = []
+''',
+"commons/core/checker/CheckerUtils.py": '''
+import re
+
+class CheckerUtils(object):
+
+    @staticmethod
+    def isMax15Char(name):
+        return len(name) <= 15
+
+    @staticmethod
+    def isCharAlphanumOrUnderscore(name):
+        return re.match("^[a-zA-Z0-9_]+$", name) is not None
+''',
+"commons/core/checker/ConfigChecker.py": '''
+import ConfigParser
+
+class ConfigRules(object):
+
+    def __init__(self):
+        self.dTypes = {}
+
+    def addRuleOption(self, section, option, mandatory = False, type = "string"):
+        self.dTypes[(section, option.lower())] = type
+
+class ConfigValue(object):
+
+    def __init__(self, iConfigParser, iConfigRules):
+        self._iConfigParser = iConfigParser
+        self._iConfigRules = iConfigRules
+
+    def has_option(self, section, option):
+        return self._iConfigParser.has_option(section, option)
+
+    def get(self, section, option):
+        if not self._iConfigParser.has_option(section, option):
+            return None
+        value = self._iConfigParser.get(section, option).strip()
+        type = self._iConfigRules.dTypes.get((section, option.lower()), "string")
+        if type == "bool":
+            return value.lower() in ["yes", "true", "1"]
+        if type == "int":
+            return int(value)
+        if type == "float":
+            return float(value)
+        return value
+
+class ConfigChecker(object):
+
+    def __init__(self, configFileName, iConfigRules):
+        self._configFileName = configFileName
+        self._iConfigRules = iConfigRules
+
+    def getConfig(self):
+        iConfigParser = ConfigParser.RawConfigParser()
+        iConfigParser.read(self._configFileName)
+        return ConfigValue(iConfigParser, self._iConfigRules)
+''',
+"commons/core/sql/DbFactory.py": '''
+import os
+import sqlite3
+
+class DbStandIn(object):
+
+    def __init__(self):
+        self._conn = sqlite3.connect("bench_db.sqlite")
+        self._conn.text_factory = str
+
+    def createTable(self, tableName, dataType, fileName, overwrite = False):
+        if overwrite:
+            self._conn.execute("DROP TABLE IF EXISTS %s" % tableName)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS %s (seq_name TEXT, length INT, strand TEXT, status TEXT, class_classif TEXT, order_classif TEXT, completeness TEXT, evidence TEXT)" % tableName)
+        lRows = [(line.rstrip("\\n").split("\\t") + [""] * 8)[:8] for line in open(fileName, "r") if line.strip()]
+        self._conn.executemany("INSERT INTO %s VALUES (?, ?, ?, ?, ?, ?, ?, ?)" % tableName, lRows)
+        self._conn.commit()
+
+    def execute(self, qry):
+        self._conn.execute(qry)
+        self._conn.commit()
+
+    def doesTableExist(self, tableName):
+        return self._conn.execute("SELECT name FROM sqlite_master WHERE name = ?", (tableName,)).fetchone() is not None
+
+    def dropTable(self, tableName):
+        self._conn.execute("DROP TABLE IF EXISTS %s" % tableName)
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+class DbFactory(object):
+
+    @staticmethod
+    def createInstance():
+        return DbStandIn()
+''',
+"commons/core/sql/TableJobAdaptatorFactory.py": '''
+class TableJobAdaptatorFactory(object):
+
+    @staticmethod
+    def createInstance(iDb, jobTableName):
+        return None
+''',
+"commons/core/launcher/Launcher.py": '''
+import os
+import shutil
+
+# Runs the jobs one after the other in their own directory, as an SGE node would
+class Launcher(object):
+
+    def __init__(self, iTJA, cDir, tmpDir, queue, groupid):
+        self._cDir = cDir
+        self._tmpDir = tmpDir
+        self._groupid = groupid
+
+    def getSystemCommand(self, prg, lArgs):
+        return "log = os.system(\\"%s %s\\")" % (prg, " ".join(lArgs))
+
+    def prepareCommands_withoutIndentation(self, lCmds, lCmdStart, lCmdFinish):
+        return (lCmdStart, lCmds, lCmdFinish)
+
+    def runLauncherForMultipleJobs(self, acronym, lCmdsTuples, doClean = False):
+        count = 0
+        for lCmdStart, lCmds, lCmdFinish in lCmdsTuples:
+            count += 1
+            workDir = os.path.join(self._tmpDir, "%s_%s_%i" % (self._groupid, acronym, count))
+            if os.path.exists(workDir):
+                shutil.rmtree(workDir)
+            os.makedirs(workDir)
+            os.chdir(workDir)
+            dNamespace = {"os": os, "shutil": shutil}
+            for cmd in lCmdStart:
+                exec cmd in dNamespace
+            for cmd in lCmds:
+                exec cmd in dNamespace
+                if dNamespace["log"] != 0:
+                    raise Exception("ERROR: job '%s' failed" % cmd)
+            for cmd in lCmdFinish:
+                exec cmd in dNamespace
+            os.chdir(self._cDir)
+            if doClean:
+                shutil.rmtree(workDir)
+''',
+"commons/tools/benchStandIn.py": STANDIN_COMMON,
+"commons/tools/LaunchPASTEC.py": '''
+import os
+import sys
+import ConfigParser
+from optparse import OptionParser
+from commons.tools.benchStandIn import readFasta, writeClassif, classify, work
+from commons.core.sql.DbFactory import DbFactory
+
+class LaunchPASTEC(object):
+
+    def __init__(self, configFileName = "", decisionRulesFileName = "", inputFileName = "", projectName = "", step = "0", verbose = 0):
+        self._configFileName = configFileName
+        self._inputFileName = inputFileName
+        self._projectName = projectName
+        self._step = step
+
+    def run(self):
+        lRecords = readFasta(self._inputFileName)
+        if self._step == "1":
+            iConfigParser = ConfigParser.RawConfigParser()
+            iConfigParser.read(self._configFileName)
+            iDb = DbFactory.createInstance()
+            for option in ["TE_nucl_bank", "TE_prot_bank", "HG_nucl_bank", "rDNA_bank"]:
+                if iConfigParser.has_option("detect_features", option) and os.path.isfile(iConfigParser.get("detect_features", option).strip()):
+                    iDb.createTable("%s_%s_seq" % (self._projectName, option), "fasta", iConfigParser.get("detect_features", option).strip(), True)
+            iDb.close()
+            return
+        writeClassif([classify(header, sequence) for header, sequence in lRecords], "%s.classif" % self._projectName)
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    for option in ["-C", "-D", "-P", "-S", "-i", "-v"]:
+        parser.add_option(option, dest = option[1], action = "store", type = "string", default = "")
+    options = parser.parse_args()[0]
+    LaunchPASTEC(options.C, options.D, options.i, options.P, options.S or "0", options.v).run()
+''',
+"commons/tools/DetectTEFeatures.py": '''
+import os
+import ConfigParser
+from optparse import OptionParser
+from commons.tools.benchStandIn import readFasta, work, formatBank, BANK_INDEX_SUFFIXES
+from commons.core.sql.DbFactory import DbFactory
+
+DETECT_FEATURES_TABLES = {"term_rep": "TR_set", "polyA": "polyA_set", "tand_rep": "SSR_set", "orf": "ORF_map"}
+DETECT_FEATURES_BANKS = {"TE_nucl_bank": "nucl", "TE_prot_bank": "prot", "HG_nucl_bank": "nucl", "rDNA_bank": "nucl"}
+
+class DetectTEFeatures(object):
+
+    def __init__(self, fastaFileName, projectName, configFileName, doClean = False, verbosity = 0):
+        self._fastaFileName = fastaFileName
+        self._projectName = projectName
+        self._configFileName = configFileName
+
+    # # Like the real tool, banks are read from the current directory and formatted there when not indexed yet.
+    #
+    def _checkBanks(self, iConfigParser):
+        for option, dbType in sorted(DETECT_FEATURES_BANKS.items()):
+            if not iConfigParser.has_option("detect_features", option) or not iConfigParser.get("detect_features", option).strip():
+                continue
+            bankFileName = iConfigParser.get("detect_features", option).strip()
+            if not os.path.isfile(bankFileName):
+                raise Exception("ERROR: bank '%s' not found in '%s'" % (bankFileName, os.getcwd()))
+            if not os.path.exists("%s%s" % (bankFileName, BANK_INDEX_SUFFIXES[dbType][1])):
+                print "Format bank '%s' in '%s'" % (bankFileName, os.getcwd())
+                formatBank(bankFileName, dbType)
+
+    def run(self):
+        iConfigParser = ConfigParser.RawConfigParser()
+        iConfigParser.read(self._configFileName)
+        self._checkBanks(iConfigParser)
+        featuresFileName = "%s.features" % self._projectName
+        outFile = open(featuresFileName, "w")
+        for header, sequence in readFasta(self._fastaFileName):
+            outFile.write("%s\\t%s\\n" % (header, work(sequence.lower())))
+        outFile.close()
+        iDb = DbFactory.createInstance()
+        for option, suffix in DETECT_FEATURES_TABLES.items():
+            if iConfigParser.has_option("detect_features", option) and iConfigParser.get("detect_features", option).strip() == "yes":
+                iDb.createTable("%s_%s" % (self._projectName, suffix), "set", featuresFileName, True)
+        iDb.close()
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    for option in ["-i", "-P", "-C", "-v"]:
+        parser.add_option(option, dest = option[1], action = "store", type = "string", default = "")
+    parser.add_option("-c", dest = "c", action = "store_true", default = False)
+    options = parser.parse_args()[0]
+    DetectTEFeatures(options.i, options.P, options.C, options.c).run()
+''',
+"commons/tools/DetectTEFeatures_parallelized.py": '''
+from commons.tools.DetectTEFeatures import DetectTEFeatures
+
+class DetectTEFeatures_parallelized(DetectTEFeatures):
+    pass
+''',
+"commons/tools/benchMakeblastdb.py": '''
+import sys
+from commons.tools.benchStandIn import formatBank
+
+# makeblastdb options have several letters after a single dash, which optparse does not accept
+if __name__ == "__main__":
+    lArgs = sys.argv[1:]
+    formatBank(lArgs[lArgs.index("-in") + 1], lArgs[lArgs.index("-dbtype") + 1])
+''',
+"commons/tools/GetClassifUniq.py": '''
+import os
+from commons.tools.benchStandIn import readFasta, readClassif, writeClassif
+
+class GetClassifUniq(object):
+
+    def __init__(self, fastaFileName, classifFileName, verbosity = 0):
+        self._fastaFileName = fastaFileName
+        self._classifFileName = classifFileName
+
+    def run(self):
+        dHeaders = dict([(header, True) for header, sequence in readFasta(self._fastaFileName)])
+        lClassif = [lColumns for lColumns in readClassif(self._classifFileName) if lColumns[0] in dHeaders]
+        writeClassif(lClassif, "%s.classif" % os.path.splitext(os.path.basename(self._fastaFileName))[0])
+''',
+"commons/tools/RemoveRedundancyBasedOnCI.py": '''
+import re
+import string
+import ConfigParser
+from itertools import izip
+from commons.tools.benchStandIn import readFasta, writeFasta, readClassif
+
+COMPLEMENT = string.maketrans("ACGT", "TGCA")
+
+# Compares all pairs of sequences whose lengths allow the coverage threshold, with an ungapped alignment on both
+# strands. Sequences are kept by decreasing CI, a sequence being removed if it is redundant with a kept one.
+class RemoveRedundancyBasedOnCI(object):
+
+    def __init__(self, fastaFileName, classifFileName, configFileName, outFileName = "", doClean = False, verbosity = 0):
+        self._fastaFileName = fastaFileName
+        self._classifFileName = classifFileName
+        self._configFileName = configFileName
+        self._outFileName = outFileName
+
+    def _isRedundant(self, shorter, longer, maxMismatches):
+        for sequence in [shorter, shorter.translate(COMPLEMENT)[::-1]]:
+            nbMismatches = 0
+            for base1, base2 in izip(sequence, longer):
+                if base1 != base2:
+                    nbMismatches += 1
+                    if nbMismatches > maxMismatches:
+                        break
+            if nbMismatches <= maxMismatches:
+                return True
+        return False
+
+    def run(self):
+        iConfigParser = ConfigParser.RawConfigParser()
+        iConfigParser.read(self._configFileName)
+        identity = iConfigParser.getfloat("classif_consensus", "min_redundancy_identity")
+        coverage = iConfigParser.getfloat("classif_consensus", "min_redundancy_coverage")
+        lRecords = readFasta(self._fastaFileName)
+        dCI = {}
+        for lColumns in readClassif(self._classifFileName):
+            match = re.search("CI=(\\d+)", lColumns[-1])
+            dCI[lColumns[0]] = match and int(match.group(1)) or 0
+        lRanked = sorted(range(len(lRecords)), key = lambda index: (-dCI.get(lRecords[index][0], 0), index))
+        lKept = []
+        for index in lRanked:
+            sequence = lRecords[index][1]
+            isRedundant = False
+            for keptIndex in lKept:
+                keptSequence = lRecords[keptIndex][1]
+                shorter, longer = sorted([sequence, keptSequence], key = len)
+                if len(shorter) < coverage / 100.0 * len(longer):
+                    continue
+                if self._isRedundant(shorter, longer, int((1 - identity / 100.0) * len(shorter))):
+                    isRedundant = True
+                    break
+            if not isRedundant:
+                lKept.append(index)
+        sKept = set(lKept)
+        writeFasta([lRecords[index] for index in range(len(lRecords)) if index in sKept], self._outFileName)
+''',
+"commons/tools/ReverseComplementAccordingToClassif.py": '''
+import os
+import string
+from commons.tools.benchStandIn import readFasta, writeFasta, readClassif, writeClassif
+
+class ReverseComplementAccordingToClassif(object):
+
+    def __init__(self, fastaFile = "", classifFileName = "", isOutClassif = False):
+        self._fastaFileName = fastaFile
+        self._classifFileName = classifFileName
+
+    def run(self):
+        complement = string.maketrans("ACGTacgt", "TGCAtgca")
+        dClassif = dict([(lColumns[0], lColumns) for lColumns in readClassif(self._classifFileName)])
+        lRecords = []
+        lClassif = []
+        for header, sequence in readFasta(self._fastaFileName):
+            lColumns = dClassif.get(header)
+            if lColumns is not None and lColumns[2] == "-":
+                header = "%s_reversed" % header
+                sequence = sequence.translate(complement)[::-1]
+                lColumns = [header, lColumns[1], "+"] + lColumns[3:]
+            lRecords.append((header, sequence))
+            if lColumns is not None:
+                lClassif.append(lColumns)
+        outFastaFileName = "%s_negStrandReversed.fa" % os.path.splitext(self._fastaFileName)[0]
+        writeFasta(lRecords, outFastaFileName)
+        writeClassif(lClassif, "%s.classif" % os.path.splitext(outFastaFileName)[0])
+''',
+"commons/tools/RenameHeaderClassif.py": '''
+import os
+from commons.tools.benchStandIn import readFasta, writeFasta, readClassif, writeClassif
+
+# Wicker's code of the orders, of the classes when the order is unknown
+ORDER2CODE = {"LTR": "RLX", "DIRS": "RYX", "PLE": "RPX", "LINE": "RIX", "SINE": "RSX", "TRIM": "RXX-TRIM", "LARD": "RXX-LARD",
+              "TIR": "DTX", "MITE": "DXX-MITE", "Helitron": "DHX", "Maverick": "DMX", "Crypton": "DYX"}
+CLASS2CODE = {"I": "RXX", "II": "DXX"}
+COMPLETENESS2CODE = {"complete": "comp", "incomplete": "incomp"}
+LSHORTEN = [("_Blaster_Grouper_", "-B-G"), ("_Blaster_Recon_", "-B-R"), ("_Blaster_Piler_", "-B-P"), ("_Map_", "-Map")]
+
+class RenameHeaderClassif(object):
+
+    def __init__(self, classifFileName = "", fastaFileName = "", projectName = "", isShorten = False, renameInClassif = False):
+        self._fastaFileName = fastaFileName
+        self._classifFileName = classifFileName
+        self._isShorten = isShorten
+
+    def getCode(self, lColumns):
+        classif, order, completeness = lColumns[4:7]
+        if order in ORDER2CODE:
+            code = ORDER2CODE[order]
+        elif classif in CLASS2CODE:
+            code = CLASS2CODE[classif]
+        else:
+            code = order
+        if code != order and completeness in COMPLETENESS2CODE:
+            code = "%s-%s" % (code, COMPLETENESS2CODE[completeness])
+        if lColumns[3] == "PotentialChimeric":
+            code = "%s-chim" % code
+        return code
+
+    def getShortName(self, name):
+        if self._isShorten:
+            for longItem, shortItem in LSHORTEN:
+                name = name.replace(longItem, shortItem)
+        return name
+
+    def run(self):
+        dClassif = dict([(lColumns[0], lColumns) for lColumns in readClassif(self._classifFileName)])
+        lRecords = []
+        lClassif = []
+        for header, sequence in readFasta(self._fastaFileName):
+            lColumns = dClassif.get(header)
+            if lColumns is not None:
+                header = "%s_%s" % (self.getCode(lColumns), self.getShortName(header))
+                lClassif.append([header] + lColumns[1:])
+            lRecords.append((header, sequence))
+        outFastaFileName = "%s_WickerH.fa" % os.path.splitext(self._fastaFileName)[0]
+        writeFasta(lRecords, outFastaFileName)
+        writeClassif(lClassif, "%s.classif" % os.path.splitext(outFastaFileName)[0])
+''',
+"commons/tools/NoCatBestHitClassifier.py": '''
+import os
+import re
+import shutil
+from commons.tools.benchStandIn import readClassif, writeClassif
+
+# TE bank hit of the coding evidence: name, class, order, superfamily, coverage
+TE_HIT = re.compile("([^\\\\s;:(),]+):Class(I{1,2}):([^:;]+):([^:;]*):\\\\s*([0-9.]+)%")
+
+class NoCatBestHitClassifier(object):
+
+    def __init__(self, fastaFileName = "", classifFileName = ""):
+        self._fastaFileName = fastaFileName
+        self._classifFileName = classifFileName
+
+    def run(self):
+        lClassif = []
+        for lColumns in readClassif(self._classifFileName):
+            if lColumns[5] == "noCat":
+                lHits = TE_HIT.findall(lColumns[7].split("struct=")[0])
+                if lHits:
+                    hitName, hitClass, hitOrder, hitSuperfamily, hitCoverage = max(lHits, key = lambda hit: float(hit[4]))
+                    lColumns = lColumns[:4] + [hitClass, hitOrder] + lColumns[6:]
+            lClassif.append(lColumns)
+        outFastaFileName = "%s_noCatBestHit.fa" % os.path.splitext(self._fastaFileName)[0]
+        shutil.copy(self._fastaFileName, outFastaFileName)
+        writeClassif(lClassif, "%s.classif" % os.path.splitext(outFastaFileName)[0])
+''',
+"PASTEC/StatPastec.py": '''
+from commons.tools.benchStandIn import readClassif
+
+# Counts of sequences per class, per order and per completeness within an order
+class StatPastec(object):
+
+    def __init__(self, inFileName = ""):
+        self._inFileName = inFileName
+
+    def run(self):
+        dCounts = {}
+        lClassif = readClassif(self._inFileName)
+        for lColumns in lClassif:
+            classif, order, completeness = lColumns[4:7]
+            for key in [("class", classif), ("order", classif, order), ("completeness", classif, order, completeness)]:
+                dCounts[key] = dCounts.get(key, 0) + 1
+        outFile = open("%s_stats.txt" % self._inFileName, "w")
+        outFile.write("sequences\\t%i\\n" % len(lClassif))
+        for key in sorted(dCounts.keys()):
+            outFile.write("%s\\t%i\\n" % ("\\t".join(key), dCounts[key]))
+        outFile.close()
+''',
+}
+
+STANDIN_SCRIPTS = {
+"LaunchPASTEC.py": "commons/tools/LaunchPASTEC.py",
+"DetectTEFeatures.py": "commons/tools/DetectTEFeatures.py",
+"makeblastdb": "commons/tools/benchMakeblastdb.py",
+}
+
+CONFIG_TEMPLATE = """[repet_env]
+repet_version: 1.0
+repet_host: localhost
+repet_user: bench
+repet_pw: bench
+repet_db: bench
+repet_port: 3306
+repet_job_manager: SGE
+
+[project]
+project_name: bench
+project_dir: .
+
+[detect_features]
+term_rep: yes
+polyA: yes
+tand_rep: yes
+orf: yes
+blast: blastplus
+TE_nucl_bank: %(TE_nucl_bank)s
+clean: yes
+
+[classif_consensus]
+remove_redundancy: %(remove_redundancy)s
+min_redundancy_identity: 95
+min_redundancy_coverage: 98
+rev_complement: %(rev_complement)s
+add_wicker_code: %(add_wicker_code)s
+add_noCat_bestHitClassif: %(add_noCat_bestHitClassif)s
+clean: no
+limit_job_nb: %(limit_job_nb)i
+resources:
+tmpDir:
+"""
+
+# Name, PASTEClassifier.py options, post processing options set to 'yes'
+SCENARIOS = [
+    ("sequential", [], []),
+    ("parallel_local", ["-p", "-e", "local", "-s", "offset"], []),
+    ("parallel_local_dynamic", ["-p", "-e", "local", "-s", "offset", "-d"], []),
+    ("parallel_launcher", ["-p"], []),
+    ("removeRedundancy", ["-p", "-e", "local", "-s", "offset"], ["remove_redundancy"]),
+    ("removeRedundancy_prefilter", ["-p", "-e", "local", "-s", "offset", "-R"], ["remove_redundancy"]),
+    ("revComplement", ["-p", "-e", "local", "-s", "offset"], ["rev_complement"]),
+    ("wickerCode", ["-p", "-e", "local", "-s", "offset"], ["add_wicker_code"]),
+    ("noCatBestHit", ["-p", "-e", "local", "-s", "offset"], ["add_noCat_bestHitClassif"]),
+    ("allPostProcess", ["-p", "-e", "local", "-s", "offset"], ["remove_redundancy", "rev_complement", "add_wicker_code", "add_noCat_bestHitClassif"]),
+    ("allPostProcess_fused", ["-p", "-e", "local", "-s", "offset", "-f"], ["remove_redundancy", "rev_complement", "add_wicker_code", "add_noCat_bestHitClassif"]),
+    ("pipelined_bank", ["-p", "-e", "local", "-s", "offset", "-l"], []),
+    ("pipelined_bank_launcher", ["-p", "-s", "offset", "-l"], []),
+]
+
+# Above this number of sequences, scenarios removing redundancy are skipped: the RemoveRedundancyBasedOnCI stand-in
+# compares all pairs of sequences
+MAX_REDUNDANCY_NB_SEQ = 10000
+
+# Scenarios run with a TE_nucl_bank in [detect_features], made of every 20th consensus of the library
+BANK_SCENARIOS = ["pipelined_bank", "pipelined_bank_launcher"]
+
+# Pairs of scenarios whose final fasta and classif files must be byte-identical
+EQUIVALENT_SCENARIOS = [
+    ("parallel_local", "parallel_local_dynamic"),
+    ("removeRedundancy", "removeRedundancy_prefilter"),
+    ("allPostProcess", "allPostProcess_fused"),
+    ("parallel_local", "pipelined_bank"),
+    ("parallel_launcher", "pipelined_bank_launcher"),
+]
+
+####PASTEClassifierBenchmark
+#
+class PASTEClassifierBenchmark(object):
+
+    def __init__(self, lSizes = [1000, 10000, 100000], lScenarios = [], outDir = "PASTEClassifierBenchmark", seed = 1, workFactor = 1, nbJobs = 8, verbosity = 1):
+        self._lSizes = lSizes
+        self._lScenarios = lScenarios
+        self._outDir = os.path.abspath(outDir)
+        self._seed = seed
+        self._workFactor = workFactor
+        self._nbJobs = nbJobs
+        self._verbosity = verbosity
+        self._classifierFileName = os.path.join(os.path.dirname(os.path.abspath(__file__)), "PASTEClassifier.py")
+
+    def setAttributesFromCmdLine(self):
+        description = "Benchmark PASTEClassifier.py on synthetic consensus libraries, with deterministic stand-ins of\n"
+        description += "the REPET tools (no BLAST, HMMER, MySQL nor SGE needed).\n"
+        description += "Reports per stage throughput (sequences/s, MB/s) from the run traces, and the peak memory of the run\n"
+        description += "(high-water mark of PASTEClassifier.py or of its largest child process).\n"
+        epilog = "Example: 1k and 10k sequences, two scenarios\n"
+        epilog += "\t$ PASTEClassifierBenchmark.py -n 1000,10000 -s sequential,allPostProcess_fused\n"
+        parser = OptionParser(description = description, epilog = epilog, usage = "PASTEClassifierBenchmark.py [options]")
+        parser.add_option("-n", "--sizes",     dest = "sizes",      action = "store", type = "string", help = "numbers of sequences of the libraries [default: 1000,10000,100000]", default = "1000,10000,100000")
+        parser.add_option("-s", "--scenarios", dest = "scenarios",  action = "store", type = "string", help = "scenarios among %s [default: all]" % ",".join([scenario[0] for scenario in SCENARIOS]), default = "")
+        parser.add_option("-o", "--outDir",    dest = "outDir",     action = "store", type = "string", help = "output directory [default: PASTEClassifierBenchmark]", default = "PASTEClassifierBenchmark")
+        parser.add_option("-r", "--seed",      dest = "seed",       action = "store", type = "int",    help = "random seed of the libraries [default: 1]", default = 1)
+        parser.add_option("-w", "--work",      dest = "workFactor", action = "store", type = "int",    help = "stand-in tools work per sequence [default: 1]", default = 1)
+        parser.add_option("-j", "--jobs",      dest = "nbJobs",     action = "store", type = "int",    help = "limit_job_nb of the parallel scenarios [default: 8]", default = 8)
+        parser.add_option("-v", "--verbosity", dest = "verbosity",  action = "store", type = "int",    help = "verbosity [default: 1]", default = 1)
+        options = parser.parse_args()[0]
+        self._lSizes = [int(size) for size in options.sizes.split(",")]
+        self._lScenarios = [scenario for scenario in options.scenarios.split(",") if scenario]
+        self._outDir = os.path.abspath(options.outDir)
+        self._seed = options.seed
+        self._workFactor = options.workFactor
+        self._nbJobs = options.nbJobs
+        self._verbosity = options.verbosity
+
+    # # Write a library with a realistic length skew: mostly short SSR-like consensus, some mid-size ones and a few
+    # long LTR/Helitron-like ones. About 5% of the consensus are redundant copies of a previous one, with 1% of
+    # substitutions, half of them reverse complemented.
+    #
+    def generateLibrary(self, nbSeq, fastaFileName):
+        iRandom = random.Random("%s_%i" % (self._seed, nbSeq))
+        outFile = open(fastaFileName, "w")
+        lSequences = []
+        for i in range(nbSeq):
+            draw = iRandom.random()
+            if lSequences and iRandom.random() < 0.05:
+                sequence = iRandom.choice(lSequences)
+                sequence = "".join([base if iRandom.random() > 0.01 else iRandom.choice("ACGT") for base in sequence])
+                if iRandom.random() < 0.5:
+                    sequence = sequence.translate(string.maketrans("ACGT", "TGCA"))[::-1]
+            elif draw < 0.80:
+                unit = "".join([iRandom.choice("ACGT") for j in range(iRandom.randint(2, 12))])
+                length = iRandom.randint(150, 600)
+                sequence = (unit * (length / len(unit) + 1))[:length]
+                sequence = "".join([base if iRandom.random() > 0.05 else iRandom.choice("ACGT") for base in sequence])
+            else:
+                if draw < 0.95:
+                    length = iRandom.randint(1000, 5000)
+                else:
+                    length = iRandom.randint(8000, 20000)
+                sequence = "".join([iRandom.choice("ACGT") for j in range(length)])
+            lSequences.append(sequence)
+            outFile.write(">bench_Blaster_Grouper_%i_Map_%i\n" % (i + 1, iRandom.randint(1, 20)))
+            for j in range(0, len(sequence), 60):
+                outFile.write("%s\n" % sequence[j:j + 60])
+        outFile.close()
+
+    def writeBank(self, fastaFileName, bankFileName):
+        inFile = open(fastaFileName, "r")
+        outFile = open(bankFileName, "w")
+        count = 0
+        for line in inFile:
+            if line.startswith(">"):
+                count += 1
+            if count % 20 == 1:
+                outFile.write(line)
+        inFile.close()
+        outFile.close()
+
+    def installStandIns(self, standInDir):
+        for moduleFileName, source in STANDIN_MODULES.items():
+            fileName = os.path.join(standInDir, moduleFileName)
+            if not os.path.exists(os.path.dirname(fileName)):
+                os.makedirs(os.path.dirname(fileName))
+            outFile = open(fileName, "w")
+            outFile.write(source)
+            outFile.close()
+        for dirName, lSubDirNames, lFileNames in os.walk(standInDir):
+            if not os.path.exists(os.path.join(dirName, "__init__.py")) and dirName != standInDir:
+                open(os.path.join(dirName, "__init__.py"), "w").close()
+        binDir = os.path.join(standInDir, "bin")
+        if not os.path.exists(binDir):
+            os.makedirs(binDir)
+        for scriptName, moduleFileName in STANDIN_SCRIPTS.items():
+            scriptFileName = os.path.join(binDir, scriptName)
+            outFile = open(scriptFileName, "w")
+            outFile.write("#!%s\nimport os, sys, runpy\nsys.path.insert(0, os.environ[\"REPET_PATH\"])\n" % sys.executable)
+            outFile.write("runpy.run_path(os.path.join(os.environ[\"REPET_PATH\"], \"%s\"), run_name = \"__main__\")\n" % moduleFileName)
+            outFile.close()
+            os.chmod(scriptFileName, 0755)
+        return binDir
+
+    def writeConfig(self, lPostProcessOptions, configFileName, bankFileName = ""):
+        dValues = {"limit_job_nb": self._nbJobs, "TE_nucl_bank": bankFileName}
+        for option in ["remove_redundancy", "rev_complement", "add_wicker_code", "add_noCat_bestHitClassif"]:
+            dValues[option] = "no"
+        for option in lPostProcessOptions:
+            dValues[option] = "yes"
+        outFile = open(configFileName, "w")
+        outFile.write(CONFIG_TEMPLATE % dValues)
+        outFile.close()
+
+    # # Run PASTEClassifier.py on a library and compute per stage throughput from its trace.
+    #
+    # @return dict of results of the run
+    #
+    def runScenario(self, scenarioName, lOptions, lPostProcessOptions, fastaFileName, nbSeq, standInDir, binDir):
+        runDir = os.path.join(self._outDir, "%s_%i" % (scenarioName, nbSeq))
+        if os.path.exists(runDir):
+            shutil.rmtree(runDir)
+        os.makedirs(runDir)
+        os.symlink(fastaFileName, os.path.join(runDir, "library.fa"))
+        bankFileName = ""
+        if scenarioName in BANK_SCENARIOS:
+            bankFileName = "TE_bank.fa"
+            self.writeBank(fastaFileName, os.path.join(runDir, bankFileName))
+        self.writeConfig(lPostProcessOptions, os.path.join(runDir, "PASTEClassifier.cfg"), bankFileName)
+
+        dEnv = dict(os.environ)
+        dEnv["REPET_PATH"] = standInDir
+        dEnv["PATH"] = "%s:%s" % (binDir, dEnv.get("PATH", ""))
+        dEnv["PASTEC_BENCH_WORK"] = str(self._workFactor)
+        lCmd = [sys.executable, self._classifierFileName, "-i", "library.fa", "-C", "PASTEClassifier.cfg", "-t", "-v", "1"] + lOptions
+        logFile = open(os.path.join(runDir, "PASTEClassifier.log"), "w")
+        startTime = time.time()
+        status = subprocess.call(lCmd, cwd = runDir, env = dEnv, stdout = logFile, stderr = subprocess.STDOUT)
+        wallTime = time.time() - startTime
+        logFile.close()
+        dResult = {"scenario": scenarioName, "nbSeq": nbSeq, "status": status, "wallTime": wallTime, "stages": []}
+        if status != 0:
+            return dResult
+
+        megabytes = os.path.getsize(fastaFileName) / 1e6
+        dSpans = json.load(open(os.path.join(runDir, "bench_trace.json"), "r"))
+        for dSpan in dSpans["spans"]:
+            if dSpan["category"] == "batch" and dSpan["lane"] != 0:
+                continue
+            duration = max(dSpan["duration"], 1e-6)
+            dResult["stages"].append({"name": dSpan["name"], "duration": dSpan["duration"], "seqPerSec": nbSeq / duration,
+                                      "mbPerSec": megabytes / duration, "processPeakRssKb": dSpan["args"].get("processPeakRss", 0)})
+        dResult["peakRssKb"] = max([dStage["processPeakRssKb"] for dStage in dResult["stages"]] + [0])
+        return dResult
+
+    # # @return list of the final files of a run: the fasta file linked as '<project>_denovoLibTEs.fa' and its classif
+    # file, the project classif file without post processing
+    #
+    def getFinalFileNames(self, runDir):
+        fastaFileName = os.readlink(os.path.join(runDir, "bench_denovoLibTEs.fa"))
+        if fastaFileName == "library.fa":
+            return [fastaFileName, "bench.classif"]
+        return [fastaFileName, "%s.classif" % os.path.splitext(fastaFileName)[0]]
+
+    # # Compare the final files and the classification statistics of two scenarios run on the same library.
+    #
+    # @return list of the file names that differ or are missing
+    #
+    def compareScenarios(self, scenarioName, otherScenarioName, nbSeq):
+        runDir = os.path.join(self._outDir, "%s_%i" % (scenarioName, nbSeq))
+        otherRunDir = os.path.join(self._outDir, "%s_%i" % (otherScenarioName, nbSeq))
+        lFileNames = self.getFinalFileNames(runDir) + sorted([os.path.basename(fileName) for fileName in glob.glob(os.path.join(runDir, "*_stats.txt"))])
+        lOtherFileNames = self.getFinalFileNames(otherRunDir) + sorted([os.path.basename(fileName) for fileName in glob.glob(os.path.join(otherRunDir, "*_stats.txt"))])
+        if lFileNames != lOtherFileNames:
+            return sorted(set(lFileNames).symmetric_difference(lOtherFileNames)) or lFileNames
+        lDiffFileNames = []
+        for fileName in lFileNames:
+            if not filecmp.cmp(os.path.join(runDir, fileName), os.path.join(otherRunDir, fileName), shallow = False):
+                lDiffFileNames.append(fileName)
+        return lDiffFileNames
+
+    def run(self):
+        lScenarios = [scenario for scenario in SCENARIOS if not self._lScenarios or scenario[0] in self._lScenarios]
+        if not os.path.exists(self._outDir):
+            os.makedirs(self._outDir)
+        standInDir = os.path.join(self._outDir, "standIns")
+        binDir = self.installStandIns(standInDir)
+
+        lResults = []
+        for nbSeq in self._lSizes:
+            fastaFileName = os.path.join(self._outDir, "library_%i.fa" % nbSeq)
+            if not os.path.exists(fastaFileName):
+                self.generateLibrary(nbSeq, fastaFileName)
+            for scenarioName, lOptions, lPostProcessOptions in lScenarios:
+                if "remove_redundancy" in lPostProcessOptions and nbSeq > MAX_REDUNDANCY_NB_SEQ:
+                    print "%-22s %7i sequences: skipped (redundancy removal above %i sequences)" % (scenarioName, nbSeq, MAX_REDUNDANCY_NB_SEQ)
+                    continue
+                dResult = self.runScenario(scenarioName, lOptions, lPostProcessOptions, fastaFileName, nbSeq, standInDir, binDir)
+                lResults.append(dResult)
+                if dResult["status"] != 0:
+                    print "%-22s %7i sequences: FAILED (see %s_%i/PASTEClassifier.log)" % (scenarioName, nbSeq, scenarioName, nbSeq)
+                    continue
+                print "%-22s %7i sequences: %8.2fs, peak RSS %i kB" % (scenarioName, nbSeq, dResult["wallTime"], dResult["peakRssKb"])
+                if self._verbosity > 0:
+                    for dStage in dResult["stages"]:
+                        print "    %-45s %8.2fs %10.1f seq/s %8.2f MB/s" % (dStage["name"], dStage["duration"], dStage["seqPerSec"], dStage["mbPerSec"])
+            dStatus = dict([((dResult["scenario"], dResult["nbSeq"]), dResult["status"]) for dResult in lResults])
+            for scenarioName, otherScenarioName in EQUIVALENT_SCENARIOS:
+                if dStatus.get((scenarioName, nbSeq)) != 0 or dStatus.get((otherScenarioName, nbSeq)) != 0:
+                    continue
+                lDiffFileNames = self.compareScenarios(scenarioName, otherScenarioName, nbSeq)
+                lResults.append({"scenario": "%s=%s" % (scenarioName, otherScenarioName), "nbSeq": nbSeq, "status": int(len(lDiffFileNames) > 0), "differences": lDiffFileNames})
+                if lDiffFileNames:
+                    print "%s and %s, %i sequences: DIFFERENT (%s)" % (scenarioName, otherScenarioName, nbSeq, ", ".join(lDiffFileNames))
+                else:
+                    print "%s and %s, %i sequences: identical final files" % (scenarioName, otherScenarioName, nbSeq)
+        reportFileName = os.path.join(self._outDir, "report.json")
+        reportFile = open(reportFileName, "w")
+        json.dump(lResults, reportFile, indent = 1, sort_keys = True)
+        reportFile.close()
+        print "Report written in '%s'" % reportFileName
+        return lResults
+
+if __name__ == "__main__":
+    iBenchmark = PASTEClassifierBenchmark()
+    iBenchmark.setAttributesFromCmdLine()
+    iBenchmark.run()